@@ -0,0 +1,135 @@
+import sys
+import os
+import hashlib
+import time
+import types
+from ctypes import string_at
+from json import dumps
+
+# compiled shellcode keyed by a hash of its source. lives in the game process
+_code_cache = dict()
+
+def resident_shellcode(entry_point: str, *args) -> str:
+    '''
+    Returns shellcode that calls entry_point in hook_runtime with args.
+
+    sys.path and the working directory only need to be set up on the first hit.
+    After that hook_runtime is already in sys.modules, so the import is a lookup
+    and the hook runs with its modules, loggers and settings already loaded.
+    entry_point: Name of the hook_runtime function to call
+    args: Values to call it with. Must be literals that survive repr()
+    '''
+    local_paths = dumps(sys.path).replace('\\', '\\\\')
+    working_dir = dumps(os.getcwd()).replace('\\', '\\\\')
+    call_args = ', '.join(repr(arg) for arg in args)
+
+    shellcode = fr"""
+import sys
+
+try:
+    if 'hook_runtime' not in sys.modules:
+        from os import chdir
+        sys.path = {local_paths}
+        chdir({working_dir})
+    import hook_runtime
+    hook_runtime.{entry_point}({call_args})
+except:
+    from traceback import format_exc
+    with open('out.log', 'a+') as f:
+        f.write(format_exc())
+    """
+
+    return str(shellcode)
+
+def shellcode_digest(shellcode: str) -> str:
+    '''Returns the key a shellcode is cached under.'''
+    return hashlib.sha1(shellcode.encode('utf-8')).hexdigest()[:16]
+
+def loader_shellcode(shellcode_address: int, shellcode: str) -> str:
+    '''
+    Returns the stub that PyRun_SimpleString runs on every hook hit.
+
+    The full shellcode stays in memory at shellcode_address. The first hit runs
+    it directly, which imports hook_runtime into __main__. From then on
+    run_cached_shellcode compiles it a single time and every later hit runs the
+    cached code object, so the only thing compiled per hit is this small stub.
+    '''
+    size = len(shellcode.encode('utf-8'))
+    digest = shellcode_digest(shellcode)
+
+    return (
+        f"try: hook_runtime.run_cached_shellcode({shellcode_address}, {size}, '{digest}')\n"
+        f"except NameError: exec(__import__('ctypes').string_at({shellcode_address}, {size}).decode('utf-8'))\n"
+    )
+
+def get_compiled_shellcode(digest: str, read_source) -> types.CodeType:
+    '''
+    Returns the compiled shellcode for digest, compiling it on first use.
+    read_source: Called to get the source when it isn't cached yet
+    '''
+    code = _code_cache.get(digest)
+    if code is None:
+        code = compile(read_source(), '<hook ' + digest + '>', 'exec')
+        _code_cache[digest] = code
+
+    return code
+
+def run_cached_shellcode(shellcode_address: int, size: int, digest: str):
+    '''
+    Runs the shellcode written at shellcode_address in this process.
+    Called from inside the game through loader_shellcode.
+    '''
+    code = get_compiled_shellcode(digest, lambda: string_at(shellcode_address, size).decode('utf-8'))
+    exec(code, {'__name__': '__main__'})
+
+def benchmark(iterations=10000):
+    '''
+    Compares compiling the hook shellcode on every hit (what PyRun_SimpleString
+    did before) with compiling only the loader and running the cached shellcode.
+    hook_runtime's entry points are swapped for no-ops so only the cost of the
+    shellcode itself is measured.
+    '''
+    from ctypes import addressof, create_string_buffer
+    from api_translate.dialog import translate_shellcode, load_evtx_shellcode
+    from api_translate.quest import quest_text_shellcode
+
+    shellcodes = {
+        'dialog': translate_shellcode(0x1000, 0x1004, 'deepl', 'key', 'False', 'False', 'EN-US', False),
+        'quest': quest_text_shellcode(0x1000, 'deepl', 'key', 'False', 'False', 'EN-US', False),
+        'load_evtx': load_evtx_shellcode(0x1008),
+    }
+
+    runtime = types.ModuleType('hook_runtime')
+    for entry_point in ('dialog_hook', 'quest_text_hook', 'load_evtx_hook'):
+        setattr(runtime, entry_point, lambda *args: None)
+    runtime.run_cached_shellcode = run_cached_shellcode
+    previous = sys.modules.get('hook_runtime')
+    sys.modules['hook_runtime'] = runtime
+
+    try:
+        for name, shellcode in shellcodes.items():
+            start = time.perf_counter()
+            for _ in range(iterations):
+                exec(compile(shellcode, '<string>', 'exec'), {'__name__': '__main__'})
+            uncached = (time.perf_counter() - start) / iterations
+
+            # stands in for the memory the shellcode is written to in the game
+            buffer = create_string_buffer(shellcode.encode('utf-8'))
+            loader = loader_shellcode(addressof(buffer), shellcode)
+            main = {'__name__': '__main__', 'hook_runtime': runtime}
+            start = time.perf_counter()
+            for _ in range(iterations):
+                exec(compile(loader, '<string>', 'exec'), main)
+            cached = (time.perf_counter() - start) / iterations
+
+            print(f'{name:<10} {len(shellcode):>4} byte shellcode  compile+exec {uncached * 1e6:7.1f}us  loader+cached exec {cached * 1e6:7.1f}us  ({uncached / cached:.1f}x)')
+    finally:
+        if previous is None:
+            del sys.modules['hook_runtime']
+        else:
+            sys.modules['hook_runtime'] = previous
+        _code_cache.clear()
+
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    benchmark()
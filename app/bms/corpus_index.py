@@ -0,0 +1,78 @@
+'''
+Index of the json/_lang/en files used to find which file a freshly dumped EVT is.
+
+A dumped file matches a file we already have when its first few Japanese strings
+are the same. Every prefix of up to FINGERPRINT_LENGTH strings is indexed, so a
+match is a single lookup however big the corpus is. A signature of all of a file's
+strings finds files that haven't changed at all. When several files start the same
+way, they're scored by how many strings they share with the dumped file.
+'''
+from hashlib import sha1
+from corpus import load_corpus
+
+FINGERPRINT_LENGTH = 5
+
+def content_signature(strings: list) -> str:
+    '''Hash of every string in a file, in order.'''
+    return sha1('\x00'.join(strings).encode('utf-8')).hexdigest()
+
+class CorpusIndex:
+    '''
+    Maps the opening strings and full contents of each file in a corpus
+    (see corpus.load_corpus) to the file's name.
+    '''
+    def __init__(self, corpus: dict, fingerprint_length=FINGERPRINT_LENGTH):
+        self.corpus = corpus
+        self.fingerprint_length = fingerprint_length
+        self.by_prefix = dict()
+        self.by_signature = dict()
+        self._string_sets = dict()
+
+        for name, corpus_file in sorted(corpus.items()):
+            strings = corpus_file.ja
+            if not strings:
+                continue
+            self.by_signature.setdefault(content_signature(strings), name)
+            for length in range(1, min(len(strings), fingerprint_length) + 1):
+                self.by_prefix.setdefault(tuple(strings[:length]), []).append(name)
+
+    def _string_set(self, name: str) -> set:
+        if name not in self._string_sets:
+            self._string_sets[name] = set(self.corpus[name].ja)
+        return self._string_sets[name]
+
+    def candidates(self, strings: list) -> list:
+        '''Returns the files that start with the same strings as strings, by name.'''
+        return self.by_prefix.get(tuple(strings[:self.fingerprint_length]), [])
+
+    def match(self, strings: list) -> tuple:
+        '''
+        Returns (file name, confidence) for the file strings was dumped from, or
+        (None, 0.0). Confidence is 1.0 when every string is the same, otherwise the
+        share of strings the two files have in common.
+        '''
+        if not strings:
+            return None, 0.0
+
+        name = self.by_signature.get(content_signature(strings))
+        if name is not None:
+            return name, 1.0
+
+        dumped = set(strings)
+        best = None
+        best_confidence = -1.0
+        for name in self.candidates(strings):
+            existing = self._string_set(name)
+            confidence = len(dumped & existing) / len(dumped | existing)
+            if confidence > best_confidence:
+                best = name
+                best_confidence = confidence
+
+        if best is None:
+            return None, 0.0
+
+        return best, round(best_confidence, 3)
+
+def build_corpus_index(path: str, fingerprint_length=FINGERPRINT_LENGTH) -> CorpusIndex:
+    '''Loads every json file in path and indexes it.'''
+    return CorpusIndex(load_corpus(path), fingerprint_length)
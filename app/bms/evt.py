@@ -0,0 +1,168 @@
+'''
+Reads the parts of an EVT file that port_to_json needs.
+
+quickBMS dumped files are mapped into memory once and files still in DQX's memory
+are parsed from a single read. The INDX block gives the key the hex dict uses, the
+TEXT block holds the game's strings and the FOOT block marks where they end.
+
+Each block starts with a 16 byte header: its name, the header's length, the
+length of its data and 4 unused bytes. INDX's data is a table of (string id,
+offset) pairs, the offset being where the string starts in TEXT's data. That
+table gives each file a compact key made of integers (see IndxKey) and lets a
+single string be read by its id without decoding the rest of the text. The hex
+dict still keys files by the first 64 bytes of INDX, since that's what clarity
+finds in the game's memory.
+'''
+from collections import namedtuple
+from hashlib import sha1
+import mmap
+import struct
+from signatures import index_pattern, text_pattern, foot_pattern
+
+# bytes of the INDX block used as the file's key. 64 is arbitrary, but clarity expects it
+INDX_KEY_LENGTH = 64
+
+# the text starts after the TEXT header and the 00s padding it
+TEXT_HEADER_LENGTH = 15
+
+# name, header length, data length, unused
+BLOCK_HEADER = struct.Struct('<4sIII')
+
+# string id, offset of the string in TEXT's data
+INDX_ENTRY = struct.Struct('<II')
+
+# first_id/last_id: lowest and highest string id, count: number of entries, digest: 64 bit hash of the table
+IndxKey = namedtuple('IndxKey', ['first_id', 'last_id', 'count', 'digest'])
+
+# indx: INDX key bytes, text_start/text_end: offsets of the string table, strings: null separated strings,
+# entries: INDX's (string id, offset) pairs, key: IndxKey, offsets: where each string starts in TEXT's data.
+# entries and key are None if the INDX table can't be decoded
+EvtFile = namedtuple('EvtFile', ['indx', 'text_start', 'text_end', 'strings', 'entries', 'key', 'offsets'],
+                     defaults=(None, None, None))
+
+def decode_indx(data, indx_start: int) -> tuple:
+    '''
+    Returns the (string id, offset) pairs in the INDX block at indx_start as
+    integers. Raises ValueError if the block's header doesn't describe a table.
+    '''
+    if indx_start + BLOCK_HEADER.size > len(data):
+        raise ValueError('INDX header is cut off')
+    _, header_length, data_length, _ = BLOCK_HEADER.unpack_from(data, indx_start)
+    if header_length != BLOCK_HEADER.size or data_length % INDX_ENTRY.size:
+        raise ValueError(f'INDX header has lengths {header_length} and {data_length}')
+    table_start = indx_start + header_length
+    if table_start + data_length > len(data):
+        raise ValueError('INDX table is cut off')
+
+    return tuple(INDX_ENTRY.iter_unpack(data[table_start:table_start + data_length]))
+
+def indx_key(entries: tuple) -> IndxKey:
+    '''Compact key for an INDX table. Files with the same table have the same key.'''
+    ids = [string_id for string_id, _ in entries]
+    table = b''.join(INDX_ENTRY.pack(*entry) for entry in entries)
+    digest = int.from_bytes(sha1(table).digest()[:8], 'little')
+    return IndxKey(min(ids, default=0), max(ids, default=0), len(entries), digest)
+
+def string_offsets(strings: list, first_offset=0) -> list:
+    '''Where each of strings starts when they're stored null separated from first_offset.'''
+    offsets = []
+    offset = first_offset
+    for string in strings:
+        offsets.append(offset)
+        offset += len(string.encode('utf-8')) + 1
+
+    return offsets
+
+def strings_by_id(evt: EvtFile) -> dict:
+    '''Returns {string id: string} for the INDX entries that point at the start of a string.'''
+    if evt.entries is None:
+        return dict()
+    by_offset = dict(zip(evt.offsets, evt.strings))
+    return {string_id: by_offset[offset] for string_id, offset in evt.entries if offset in by_offset}
+
+def parse_evt_data(data, name='EVT') -> EvtFile:
+    '''
+    Reads an EVT file from data (bytes, or anything else with find and slicing,
+    like an mmap). name is only used in errors. Raises ValueError if it has no INDX,
+    TEXT or FOOT block or its text isn't valid UTF-8.
+    '''
+    indx_start = data.find(index_pattern)
+    if indx_start == -1:
+        raise ValueError(f'{name} has no INDX block')
+    indx = data[indx_start:indx_start + INDX_KEY_LENGTH]
+
+    text_header = data.find(text_pattern, indx_start)
+    if text_header == -1:
+        raise ValueError(f'{name} has no TEXT block')
+    text_start = text_header + TEXT_HEADER_LENGTH
+    while text_start < len(data) and data[text_start] == 0:
+        text_start += 1
+
+    text_end = data.find(foot_pattern, text_start)
+    if text_end == -1:
+        raise ValueError(f'{name} has no FOOT block')
+    text = data[text_start:text_end]
+
+    try:
+        strings = text.rstrip(b'\x00').decode('utf-8').split('\x00')
+    except UnicodeDecodeError as e:
+        raise ValueError(f'{name} has text that is not UTF-8: {e}') from None
+
+    try:
+        entries = decode_indx(data, indx_start)
+    except ValueError:
+        entries = None
+    key = indx_key(entries) if entries is not None else None
+    offsets = string_offsets(strings, text_start - (text_header + BLOCK_HEADER.size))
+
+    return EvtFile(indx, text_start, text_end, strings, entries, key, offsets)
+
+def parse_evt(file: str) -> EvtFile:
+    '''Reads an EVT file in one pass. Raises ValueError like parse_evt_data.'''
+    with open(file, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError(f'{file} is empty') from None
+        with data:
+            return parse_evt_data(data, file)
+
+def read_evt_string(file: str, string_id: int):
+    '''
+    Reads the string with string_id from an EVT file without decoding the rest of
+    its text. Returns None if the file has no such string. Raises ValueError like
+    parse_evt_data.
+    '''
+    with open(file, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError(f'{file} is empty') from None
+        with data:
+            indx_start = data.find(index_pattern)
+            if indx_start == -1:
+                raise ValueError(f'{file} has no INDX block')
+            offsets = dict(decode_indx(data, indx_start))
+            if string_id not in offsets:
+                return None
+            text_header = data.find(text_pattern, indx_start)
+            if text_header == -1:
+                raise ValueError(f'{file} has no TEXT block')
+
+            start = text_header + BLOCK_HEADER.size + offsets[string_id]
+            end = data.find(b'\x00', start)
+            string = data[start:end if end != -1 else len(data)]
+
+    try:
+        return string.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise ValueError(f'{file} has text that is not UTF-8: {e}') from None
+
+def content_name(indx: bytes, strings: list) -> str:
+    '''
+    Name for a file dumped from memory, from its INDX key and text. The same file
+    gets the same name every time it's dumped.
+    '''
+    digest = sha1(indx)
+    digest.update('\x00'.join(strings).encode('utf-8'))
+    return 'clarity_' + digest.hexdigest()
@@ -0,0 +1,128 @@
+'''
+The per file work of port_to_json's "Analyzing EVTs" step.
+
+Each dumped EVT is parsed, checked against the blacklist, converted to json and
+matched against the json files we already have. This module doesn't touch DQX
+or the files port_to_json writes, so it can run on a process pool. The results
+come back in order and port_to_json writes them out.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import json
+from blacklist import indx_blacklist
+from corpus import can_use_pool
+from corpus_index import build_corpus_index
+from evt import parse_evt
+
+EXISTING_JSON_PATH = '../../json/_lang/en'
+
+# files handed to a worker at a time
+ANALYSIS_CHUNKSIZE = 16
+
+# the blacklist is kept as spaced hex strings. compare raw INDX bytes
+INDX_BLACKLIST = frozenset(bytes.fromhex(indx) for indx in indx_blacklist)
+
+_corpus_index = None
+
+def get_corpus_index():
+    '''Indexes the json files we already have on first use.'''
+    global _corpus_index
+    if _corpus_index is None:
+        _corpus_index = build_corpus_index(EXISTING_JSON_PATH)
+
+    return _corpus_index
+
+def check_blacklist(indx: bytes):
+    '''
+    blacklist.py houses all of the files that we don't care about.
+    If a file has a matching INDX entry, return True.
+    '''
+    if indx in INDX_BLACKLIST:
+        return True
+
+def format_to_json(json_data, data, lang, number):
+    '''Accepts data that is used to return a nested json.'''
+    json_data[number]={}
+    if data == '':
+        json_data[number][f'clarity_nt_char_{number}']=f'clarity_nt_char_{number}'
+    elif data == '　':
+        json_data[number][f'clarity_ms_space_{number}']=f'clarity_ms_space_{number}'
+    else:
+        if lang == 'ja':
+            json_data[number][data]=data
+        else:
+            json_data[number][data]=''
+
+    return json_data
+
+def sanitize_bytes(data: str) -> str:
+    out_data = data.replace('\x0a', '\x7c')
+    out_data = out_data.replace('\x00', '\x0a')
+    out_data = out_data.replace('\x09', '\x5c\x74')
+
+    return out_data
+
+def evt_to_json(strings: list) -> tuple:
+    '''
+    Returns (ja json, en json, json strings) for an EVT file's strings. The json
+    strings are the keys of each entry, which is what the corpus index matches on.
+    '''
+    jsondata_ja = {}
+    jsondata_en = {}
+    number = 1
+
+    # create json string. sanitize each string for weblate
+    for line in map(sanitize_bytes, strings):
+        format_to_json(jsondata_ja, line, 'ja', number)
+        format_to_json(jsondata_en, line, 'en', number)
+        number += 1
+
+    json_ja = json.dumps(jsondata_ja, indent=2, sort_keys=False, ensure_ascii=False)
+    json_en = json.dumps(jsondata_en, indent=2, sort_keys=False, ensure_ascii=False)
+
+    return json_ja, json_en, [list(entry)[0] for entry in jsondata_en.values()]
+
+def analyze_evt(file: str) -> dict:
+    '''
+    Parses dqx_out/file and returns what port_to_json needs to write it out.
+    error is set if the file couldn't be parsed and blacklisted if it's one we
+    don't care about. Otherwise the ja and en json, the existing file it matched
+    (or None), the match's confidence and the other files it could have been.
+    '''
+    results = dict()
+    results['file'] = file
+    results['error'] = None
+    results['blacklisted'] = False
+
+    try:
+        evt = parse_evt(f'dqx_out/{file}')
+    except ValueError as e:
+        results['error'] = str(e)
+        return results
+    results['indx'] = evt.indx
+    results['key'] = evt.key
+
+    if check_blacklist(evt.indx):
+        results['blacklisted'] = True
+        return results
+
+    results['json_ja'], results['json_en'], strings = evt_to_json(evt.strings)
+    index = get_corpus_index()
+    matching_file, confidence = index.match(strings)
+    results['matching_file'] = matching_file
+    results['confidence'] = confidence
+    results['other_candidates'] = [name for name in index.candidates(strings) if name != matching_file]
+
+    return results
+
+def analyze_evts(files: list, workers=None):
+    '''
+    Yields analyze_evt's results for each file, in order. Files are analyzed on a
+    process pool unless workers is 1.
+    '''
+    if workers == 1 or not can_use_pool():
+        yield from map(analyze_evt, files)
+        return
+
+    get_corpus_index()  # writes the corpus cache, so the workers only have to read it
+    with ProcessPoolExecutor(max_workers=workers, initializer=get_corpus_index) as executor:
+        yield from executor.map(analyze_evt, files, chunksize=ANALYSIS_CHUNKSIZE)
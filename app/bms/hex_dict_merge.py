@@ -0,0 +1,71 @@
+'''
+Builds the final hex_dict.csv from the one port_to_json writes and the one we
+already have.
+
+Every entry in the new dict is kept. Entries in the old dict are kept for the
+files the new dict doesn't have at all, so files that weren't in memory or in
+the dumps aren't lost. Each INDX key can only belong to one file, since clarity
+uses the first entry it finds. Keys that are given to a second file are reported
+and the first file keeps them.
+
+    python hex_dict_merge.py -n bms_hex_dict.csv -o ../hex_dict.csv -d hex_dict.csv
+'''
+import csv
+import os
+import sys
+import click
+sys.path.append("../")
+from common import atomic_write
+
+HEX_DICT_HEADER = 'file,hex_string\n'
+
+def read_hex_dict(csv_file: str) -> list:
+    '''Returns the (file, hex_string) rows of a hex dict, in order.'''
+    with open(csv_file, 'r') as f:
+        return [(row['file'], row['hex_string']) for row in csv.DictReader(f)]
+
+def merge_hex_dicts(new_rows: list, old_rows=()) -> tuple:
+    '''
+    Returns ({hex_string: file}, conflicts). conflicts has a (hex_string, kept
+    file, dropped file) for each key found with a second file.
+    '''
+    entries = dict()
+    conflicts = []
+    new_files = {file for file, _ in new_rows}
+    old_rows = [(file, hex_string) for file, hex_string in old_rows if file not in new_files]
+
+    for file, hex_string in new_rows + old_rows:
+        kept = entries.setdefault(hex_string, file)
+        if kept != file:
+            conflicts.append((hex_string, kept, file))
+
+    return entries, conflicts
+
+def write_hex_dict(entries: dict, csv_file: str):
+    '''Writes {hex_string: file} to csv_file, sorted like sort_csv used to sort it.'''
+    lines = sorted(f'{file},{hex_string}\n' for hex_string, file in entries.items())
+    with atomic_write(csv_file, encoding=None) as f:
+        f.write(HEX_DICT_HEADER)
+        f.writelines(lines)
+
+def build_hex_dict(new_dict: str, old_dict: str, out: str) -> list:
+    '''
+    Merges the new_dict and old_dict files into out. old_dict is optional.
+    Returns the conflicts from merge_hex_dicts.
+    '''
+    old_rows = read_hex_dict(old_dict) if old_dict and os.path.exists(old_dict) else []
+    entries, conflicts = merge_hex_dicts(read_hex_dict(new_dict), old_rows)
+    write_hex_dict(entries, out)
+
+    return conflicts
+
+@click.command()
+@click.option('-n', '--new', 'new_dict', required=True, help='''Hex dict written by port_to_json.''')
+@click.option('-o', '--old', 'old_dict', default=None, help='''Hex dict we already have.''')
+@click.option('-d', '--dest', required=True, help='''Where to write the merged hex dict.''')
+def main(new_dict, old_dict, dest):
+    for hex_string, kept, dropped in build_hex_dict(new_dict, old_dict, dest):
+        click.echo(f'{hex_string} is in both {kept} and {dropped}. Kept {kept}.')
+
+if __name__ == '__main__':
+    main()
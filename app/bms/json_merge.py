@@ -0,0 +1,133 @@
+'''
+Carries the translations in our existing json files over to freshly dumped ones.
+
+Does what HyDE_'s json-conv.exe does. Every Japanese string in the dumped file
+that has a translation in the existing file (flat {ja: en} or nested
+{number: {ja: en}}) gets that translation. A string that isn't in the existing
+file at all can also take the translation at the same position, if the string
+that used to be there was edited rather than moved. Those are counted so they can
+be reviewed.
+
+    python json_merge.py -s <src> -d <dst> -o <out>
+'''
+from concurrent.futures import ProcessPoolExecutor
+from os import listdir, path
+import json
+import sys
+import click
+sys.path.append("../")
+from corpus import can_use_pool
+
+# placeholders are the same in every file and never translated
+PLACEHOLDER_PREFIXES = ('clarity_nt_char', 'clarity_ms_space')
+
+def read_json_file(file):
+    with open(file, 'r', encoding='utf-8-sig') as json_data:
+        return json.loads(json_data.read())
+
+def translation_pairs(source: dict) -> tuple:
+    '''
+    Returns ({ja: en}, {number: (ja, en)}, warnings) for a flat or nested json file.
+    Flat files have no positions.
+    '''
+    pairs = dict()
+    positions = dict()
+    warnings = []
+    for number, item in source.items():
+        if isinstance(item, str):
+            pairs[number] = item
+            continue
+        ja, en = list(item.items())[0]
+        if ja in pairs and pairs[ja] != en:
+            warnings.append(f'Duplicate entry in source json\n Src key: {number}\n Current value: {pairs[ja]}\n New value: {en}')
+        pairs[ja] = en
+        positions[number] = (ja, en)
+
+    return pairs, positions, warnings
+
+def merge_translations(source: dict, destination: dict) -> tuple:
+    '''
+    Returns (merged, stats). merged is destination with the translations from
+    source filled in. stats counts the strings matched by text, by position and
+    the warnings found in source.
+    '''
+    pairs, positions, warnings = translation_pairs(source)
+    destination_strings = {ja for item in destination.values() for ja in item}
+
+    merged = dict()
+    stats = {'by_text': 0, 'by_position': 0, 'warnings': warnings}
+    for number, item in destination.items():
+        merged[number] = dict()
+        for ja, en in item.items():
+            translation = pairs.get(ja, '')
+            if translation:
+                stats['by_text'] += not ja.startswith(PLACEHOLDER_PREFIXES)
+            elif ja not in pairs and not ja.startswith(PLACEHOLDER_PREFIXES) and number in positions:
+                old_ja, old_en = positions[number]
+                if old_en and old_ja not in destination_strings and not old_ja.startswith(PLACEHOLDER_PREFIXES):
+                    translation = old_en
+                    stats['by_position'] += 1
+            merged[number][ja] = translation or en
+
+    return merged, stats
+
+def merge_json_files(src: str, dst: str, out: str) -> dict:
+    '''
+    Merges the translations in the src file into the dst file and writes the
+    result to out. Returns the stats from merge_translations.
+    '''
+    merged, stats = merge_translations(read_json_file(src), read_json_file(dst))
+    with open(out, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(merged, indent=2, sort_keys=False, ensure_ascii=False))
+
+    return stats
+
+def _merge_json_files(args):
+    src, dst, out = args
+    try:
+        return path.basename(src), merge_json_files(src, dst, out), None
+    except (OSError, ValueError, AttributeError, IndexError) as e:
+        return path.basename(src), None, f'{type(e).__name__}: {e}'
+
+def merge_folders(src_folder: str, dst_folder: str, out_folder: str, workers=None) -> dict:
+    '''
+    Merges every json file in src_folder with the file of the same name in
+    dst_folder into out_folder, on a process pool unless workers is 1.
+    Returns {file name: stats} for the files that were merged. Warnings and
+    files that couldn't be merged are printed.
+    '''
+    jobs = [(f'{src_folder}/{file}', f'{dst_folder}/{file}', f'{out_folder}/{file}')
+            for file in sorted(listdir(src_folder)) if file.endswith('.json')]
+    if workers == 1 or len(jobs) < 2 or not can_use_pool():
+        results = map(_merge_json_files, jobs)
+        return _collect(results)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return _collect(executor.map(_merge_json_files, jobs, chunksize=8))
+
+def _collect(results) -> dict:
+    merged = dict()
+    for file, stats, error in results:
+        if error:
+            print(f'Could not merge {file}: {error}')
+            continue
+        for warning in stats['warnings']:
+            print(f'Warning ({file}): {warning}')
+        if stats['by_position']:
+            print(f"{file}: {stats['by_position']} translations carried over by position. Please review.")
+        merged[file] = stats
+
+    return merged
+
+@click.command()
+@click.option('-s', '--src', required=True, help='''Existing json file (flat or nested) with translations.''')
+@click.option('-d', '--dst', required=True, help='''Dumped json file (nested) without translations.''')
+@click.option('-o', '--out', required=True, help='''Where to write the merged json file.''')
+def main(src, dst, out):
+    stats = merge_json_files(src, dst, out)
+    for warning in stats['warnings']:
+        click.echo(f'Warning: {warning}')
+    click.echo(f"{stats['by_text']} translations carried over by text, {stats['by_position']} by position.")
+
+if __name__ == '__main__':
+    main()
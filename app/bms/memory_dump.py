@@ -0,0 +1,97 @@
+'''
+Reads the EVT files DQX has loaded straight out of its memory.
+
+A file is read from its INDX block to its FOOT block in one read and parsed with
+evt.parse_evt_data, instead of searching for each block 120 bytes at a time. The
+json files made from them are written by a single background thread, so reading
+memory never waits on the disk.
+'''
+from queue import SimpleQueue
+from threading import Thread
+import sys
+sys.path.append("../")
+from errors import MemoryReadError
+from memory import read_bytes
+from signatures import foot_pattern
+from evt import parse_evt_data
+
+# size of the first read of a file. most files fit, bigger ones double it until they do
+DUMP_READ_SIZE = 64 * 1024
+
+# reads that fail are retried smaller until they're this close to one that worked
+MIN_DUMP_READ_STEP = 16
+
+# find_first_match gives up after this many bytes too
+MAX_DUMP_READ_SIZE = 1000000
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+def read_evt(address: int):
+    '''
+    Reads the file whose INDX block starts at address. Returns an EvtFile
+    (see evt.parse_evt_data) or None if the file is incomplete. Incomplete files are
+    sometimes loaded.
+    '''
+    size = DUMP_READ_SIZE
+    data = b''
+    failed = None  # smallest read that ran past the end of readable memory
+    while True:
+        try:
+            data = read_bytes(address, size)
+        except MemoryReadError:
+            failed = size
+        else:
+            if data.find(foot_pattern) != -1 or size >= MAX_DUMP_READ_SIZE:
+                break
+
+        if failed is None:
+            size = min(size * 2, MAX_DUMP_READ_SIZE)
+        else:
+            size = (len(data) + failed) // 2  # readable memory ends somewhere in between
+        if size - len(data) < MIN_DUMP_READ_STEP:
+            break
+
+    try:
+        return parse_evt_data(data, f'EVT at {hex(address)}')
+    except ValueError:
+        return None
+
+class DumpWriter:
+    '''
+    Writes files on one background thread, in the order they were queued. All of
+    them have been written once close returns (or the with block ends).
+    '''
+    def __init__(self):
+        self.queue = SimpleQueue()
+        self.error = None
+        self.thread = Thread(target=self._run, name='DumpWriter', daemon=True)
+        self.thread.start()
+
+    def write(self, file: str, data: str):
+        self.queue.put((file, data))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            file, data = item
+            try:
+                with open(file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
+                    f.write(data)
+            except OSError as e:
+                if self.error is None:
+                    self.error = e
+
+    def close(self):
+        '''Waits for every queued file to be written. Raises the first error writing one.'''
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
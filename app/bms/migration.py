@@ -0,0 +1,121 @@
+'''
+Remembers what each dumped EVT file became, so the next patch's port only has
+to work on the files that changed.
+
+The manifest maps each file in dqx_out to the hash of its contents, its INDX key
+and the json file it ended up as. Files whose hash is already in the manifest
+are unchanged and are carried over as they are. Everything else goes through the
+full analysis, and the differences are written to a report.
+'''
+from hashlib import sha1
+import csv
+import json
+import sys
+sys.path.append("../")
+from common import atomic_write
+from evt import IndxKey
+
+MIGRATION_MANIFEST = 'migration_manifest.json'
+MIGRATION_REPORT = 'migration_report.csv'
+MANIFEST_VERSION = 1
+
+ADDED = 'added'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+REMOVED = 'removed'
+
+def evt_digest(file: str) -> str:
+    '''Hash of an EVT file's contents.'''
+    digest = sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+class MigrationManifest:
+    '''
+    What each EVT file was last time and is this time.
+
+    manifest: Manifest from the previous port. Missing or unreadable means every file is new
+    full: Ignore the previous port and treat every file as new
+    '''
+    def __init__(self, manifest=MIGRATION_MANIFEST, full=False):
+        self.manifest = manifest
+        self.previous = dict()
+        self.current = dict()
+        self.statuses = dict()
+        self.digests = dict()
+
+        try:
+            with open(manifest, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION and not full:
+                self.previous = data['files']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        self.by_digest = {entry['digest']: entry for entry in self.previous.values()}
+
+    def check(self, directory: str, files: list) -> dict:
+        '''
+        Hashes each file in directory and returns {file: status}. A file is unchanged
+        when a file with the same contents (under any name) was ported before.
+        '''
+        for file in files:
+            digest = evt_digest(f'{directory}/{file}')
+            self.digests[file] = digest
+            if digest in self.by_digest:
+                self.statuses[file] = UNCHANGED
+            elif file in self.previous:
+                self.statuses[file] = CHANGED
+            else:
+                self.statuses[file] = ADDED
+
+        return self.statuses
+
+    def previous_entry(self, file: str) -> dict:
+        '''
+        Returns what an unchanged file became last time. key is an evt.IndxKey, or
+        None if it wasn't recorded.
+        '''
+        entry = dict(self.by_digest[self.digests[file]])
+        entry['key'] = IndxKey(*entry['key']) if entry.get('key') else None  # json has it as a list
+
+        return entry
+
+    def record(self, file: str, indx=None, json_file=None, key=None):
+        '''
+        Records what file became this time. indx is its spaced INDX key, json_file
+        its name in the hex dict and key its evt.IndxKey, all None for files that are
+        always skipped. Files that aren't recorded are ported again next time.
+        '''
+        self.current[file] = {'digest': self.digests[file], 'indx': indx, 'json': json_file, 'key': key}
+
+    def removed(self) -> list:
+        '''Files from the previous port whose contents aren't in this one.'''
+        digests = set(self.digests.values())
+        return sorted(file for file, entry in self.previous.items() if file not in self.digests and entry['digest'] not in digests)
+
+    def save(self):
+        with atomic_write(self.manifest) as f:
+            json.dump({'version': MANIFEST_VERSION, 'files': self.current}, f, indent=2, sort_keys=True)
+
+    def write_report(self, report=MIGRATION_REPORT) -> dict:
+        '''
+        Writes each added, changed and removed file (and the json it belongs to) to
+        report and returns how many files have each status.
+        '''
+        counts = {ADDED: 0, CHANGED: 0, UNCHANGED: 0, REMOVED: 0}
+        with open(report, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['status', 'evt', 'json'])
+            for file, status in sorted(self.statuses.items()):
+                counts[status] += 1
+                if status != UNCHANGED:
+                    writer.writerow([status, file, self.current.get(file, dict()).get('json') or ''])
+            for file in self.removed():
+                counts[REMOVED] += 1
+                writer.writerow([REMOVED, file, self.previous[file]['json'] or ''])
+
+        return counts
@@ -1,29 +1,64 @@
-from os import listdir, path, remove, mkdir, makedirs, system
+from os import listdir, path, remove, mkdir, makedirs
 from shutil import rmtree, copy2
 from pathlib import Path
-import json
-import random
 from alive_progress import alive_bar
 import csv
 import sys
 sys.path.append("../")
-from clarity import query_csv
-from signatures import text_pattern, index_pattern, foot_pattern
-from memory import pattern_scan, read_bytes, get_start_of_game_text, find_first_match
-from blacklist import indx_blacklist
+from signatures import index_pattern
+from evt import content_name
+from evt_analysis import analyze_evts, evt_to_json, get_corpus_index
+from migration import MigrationManifest, UNCHANGED
+from json_merge import merge_folders
+from hex_dict_merge import read_hex_dict, build_hex_dict
 
 def write_file(path: str, filename: str, attr: str, data: str):
     '''Writes a string to a file.'''
     with open(f'{path}/{filename}', attr, encoding='utf-8') as open_file:
         open_file.write(data)
 
-def write_csv(hex_bytes: str, filename: str):
+class HexDict:
+    '''
+    The INDX keys (as raw bytes) and file names in bms_hex_dict.csv, so checking
+    for an entry doesn't mean reading the file again. write_csv keeps it up to date.
+    keys maps the INDX bytes of the files added this run to their evt.IndxKey, when
+    their INDX table could be decoded. The csv itself only has the INDX bytes.
+    '''
+    def __init__(self, csv_file='bms_hex_dict.csv'):
+        self.indx = set()
+        self.files = set()
+        self.keys = dict()
+        if path.exists(csv_file):
+            with open(csv_file) as f:
+                for row in csv.DictReader(f):
+                    self.add(row['hex_string'], row['file'])
+
+    def add(self, hex_bytes: str, filename: str, key=None):
+        indx = bytes.fromhex(hex_bytes)
+        self.indx.add(indx)
+        self.files.add(filename)
+        if key is not None:
+            self.keys.setdefault(indx, key)
+
+_hex_dict = None
+
+def get_hex_dict() -> HexDict:
+    '''Reads bms_hex_dict.csv on first use.'''
+    global _hex_dict
+    if _hex_dict is None:
+        _hex_dict = HexDict()
+
+    return _hex_dict
+
+def write_csv(hex_bytes: str, filename: str, key=None):
     csv_file = 'bms_hex_dict.csv'
+    hex_dict = get_hex_dict()
     csv = Path(csv_file)
     if not csv.is_file():
         write_file('./', csv_file, 'a', 'file,hex_string\n')
 
     write_file('./', csv_file, 'a', f'{filename},{hex_bytes}\n')
+    hex_dict.add(hex_bytes, filename, key)
 
 def split_hex_into_spaces(hex_str: str):
     '''
@@ -33,12 +68,13 @@ def split_hex_into_spaces(hex_str: str):
     spaced_str = " ".join(hex_str[i:i+2] for i in range(0, len(hex_str), 2))
     return spaced_str.upper()
 
-def write_dict(file: str, new_name: str, skip_file_read=False, hex_bytes=''):
+def write_dict(file: str, new_name: str, skip_file_read=False, hex_bytes='', key=None):
     '''
     Writes entry in hex_dict file.
 
     file: Dumped file name to read for INDX
     new_name: What to name the file in hex_dict
+    key: The file's evt.IndxKey, if known
     '''
     if not skip_file_read:
         with open(f'dqx_out/{file}', 'rb') as f:
@@ -52,87 +88,46 @@ def write_dict(file: str, new_name: str, skip_file_read=False, hex_bytes=''):
     else:
         split_hex = hex_bytes
 
-    write_csv(split_hex, new_name)
+    write_csv(split_hex, new_name, key)
 
-def query_csv(file: str, compare_type='hex') -> bool:
+def query_csv(file, compare_type='hex') -> bool:
     '''
-    Accepts an EVT file, queries the header for INDX bytes and checks if entry exists in CSV.
+    Checks if an entry exists in CSV.
+
+    file: INDX bytes of an EVT file (raw or spaced like the hex dict has them), or
+        its json file name when compare_type is 'filename'
     '''
+    hex_dict = get_hex_dict()
     if compare_type == 'hex':
-        with open(f'{file}', 'rb') as f:
-            the_bytes = f.seek(80)  # INDX starts at 0x80
-            the_bytes = f.read(64)  # get unique bytes for hex dict. 64 is arbitrary
-        with open('bms_hex_dict.csv') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                if row['hex_string'] == split_hex_into_spaces(the_bytes.hex()):
-                    return True
+        indx = file if isinstance(file, bytes) else bytes.fromhex(file)
+        return indx in hex_dict.indx
     elif compare_type == 'filename':
-        with open('bms_hex_dict.csv') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['file'] == f'json\_lang\en\{file}':
-                    return True
+        return f'json\\_lang\\en\\{file}' in hex_dict.files
 
-def check_blacklist(file: str):
+def has_entry(indx, key=None, source='') -> bool:
     '''
-    blacklist.py houses all of the files that we don't care about.
-    If a file has a matching INDX entry, return True.
+    Checks if a file with these INDX bytes already has an entry. clarity finds files
+    by those 64 bytes, so only the first file with them gets one. If the IndxKeys
+    show the file with the entry is a different one, that's reported.
+
+    indx: INDX bytes of the file, raw or spaced
+    key: The file's evt.IndxKey or None
+    source: Name of the file, used in the report
     '''
-    with open(f'{file}', 'rb') as f:
-        the_bytes = f.seek(80)  # INDX starts at 0x80
-        the_bytes = f.read(64)  # get unique bytes for hex dict. 64 is arbitrary
-    
-    if the_bytes in indx_blacklist:
-        return True
-
-def __find_start_of_text(file: str) -> int:
-    with open(f'dqx_out/{file}', 'rb') as f:
-        s = f.read()
-    start_position = s.find(text_pattern)
-    if start_position:
-        return int(start_position)
-
-def __find_start_of_game_text(file: str) -> int:
-    position = __find_start_of_text(file)
-    with open(f'dqx_out/{file}', 'rb') as f:
-        start = f.seek(position + 14)  # jump passed junk bytes
-        start = f.read(1)
-        while start:
-            start = f.read(1)
-            if start != b'\x00':
-                return int(f.tell() - 1)
-
-def __find_end_of_game_text(file: str, position: int) -> int:
-    with open(f'dqx_out/{file}', 'rb') as f:
-        s = f.read()
-    end_position = s.find(foot_pattern, position)
-    if end_position:  # we reached eof, but have junk bytes
-        return int(end_position)
-
-def get_text_range(file: str) -> tuple:
-    text_start = __find_start_of_game_text(file)
-    text_end = __find_end_of_game_text(file, text_start)
-    return (text_start, text_end)
-
-def format_to_json(json_data, data, lang, number):
-    '''Accepts data that is used to return a nested json.'''
-    json_data[number]={}
-    if data == '':
-        json_data[number][f'clarity_nt_char_{number}']=f'clarity_nt_char_{number}'
-    elif data == '　':
-        json_data[number][f'clarity_ms_space_{number}']=f'clarity_ms_space_{number}'
-    else:
-        if lang == 'ja':
-            json_data[number][data]=data
-        else:
-            json_data[number][data]=''
+    indx = indx if isinstance(indx, bytes) else bytes.fromhex(indx)
+    if not query_csv(indx):
+        return False
+    existing = get_hex_dict().keys.get(indx)
+    if key is not None and existing is not None and key != existing:
+        print(f'{source} shares its INDX bytes with a different file that already has an entry. Skipped.')
 
-    return json_data
+    return True
 
 def clean_workspace():
+    global _hex_dict
     if path.exists('bms_hex_dict.csv'):
         remove('bms_hex_dict.csv')
+    _hex_dict = None
 
     if path.exists('hex_dict.csv'):
         remove('hex_dict.csv')
@@ -153,202 +148,128 @@ def clean_workspace():
             rmtree(f'hyde_json_merge/{folder}')
         mkdir(f'hyde_json_merge/{folder}')
 
-def sanitize_bytes(data: str) -> str:
-    out_data = data.replace('\x0a', '\x7c')
-    out_data = out_data.replace('\x00', '\x0a')
-    out_data = out_data.replace('\x09', '\x5c\x74')
-    
-    return out_data
-
-def read_json_file(file):
-    with open(file, 'r', encoding='utf-8') as json_data:
-        return json.loads(json_data.read())
-
-def compare_jsons(source: str):
+def compare_jsons(source: str, strings: list):
     '''
-    Compare the top few entries of a json file with another and look for a match.
-    Returns either the name of the file we already have or nothing if no match.
+    Looks up the first few strings of a dumped file in the index of the files we
+    already have. Returns either the name of the file we already have or nothing
+    if no match. Matches that only share some of their strings are printed with
+    their confidence.
 
-    source: Diff file dumped by bms
+    source: Name of the dumped file
+    strings: The dumped file's json strings (see evt_analysis.evt_to_json)
     '''
-    orig = read_json_file(f'json_out/en/{source}')
-    orig_list = []
-    count = 0
-    # grab first 5 entries from file we already have
-    for item in orig:
-        count += 1
-        key, value = list(orig[item].items())[0]
-        orig_list.append(key)
-        if count == 5:
-            break
-    # match the previous 5 entries against every json file until we find a match
-    for file in listdir('../../json/_lang/en'):
-        new = read_json_file(f'../../json/_lang/en/{file}')
-        list_len = len(orig_list)
-        count = 0
-        for item in new:
-            key, value = list(new[item].items())[0]
-            if list_len == count:
-                return file
-            elif key == orig_list[count] and list_len > count:  # some files don't have 5 entries
-                count += 1
-                continue
-            else:
-                break
-
-def __format_to_json(json_data, data, lang, number):
-    '''Accepts data that is used to return a nested json.'''
-    json_data[number]={}
-    if data == '':
-        json_data[number][f'clarity_nt_char_{number}']=f'clarity_nt_char_{number}'
-    elif data == '　':
-        json_data[number][f'clarity_ms_space_{number}']=f'clarity_ms_space_{number}'
-    else:
-        if lang == 'ja':
-            json_data[number][data]=data
-        else:
-            json_data[number][data]=''
+    index = get_corpus_index()
+    matching_file, confidence = index.match(strings)
+    if matching_file and confidence < 1.0:
+        others = [file for file in index.candidates(strings) if file != matching_file]
+        if others:
+            print(f'{source} matched {matching_file} (confidence {confidence}) over {", ".join(others)}.')
 
-    return json_data
+    return matching_file
 
 def dump_all_game_files():
     '''
-    Searches for all INDX entries in memory and dumps
-    the entire region, then converts said region to nested json.
+    Searches for all INDX entries in memory, reads each file in one go and
+    converts it to nested json. A file loaded more than once is only dumped once
+    and is named after its contents.
     '''
+    # importing memory attaches to DQX. not at the top, so the analysis and merge
+    # workers (which import this module again when they're spawned) don't
+    from memory import pattern_scan
+    from memory_dump import read_evt, DumpWriter
+
     game_file_addresses = pattern_scan(pattern=index_pattern, return_multiple=True)
+    dumped = dict()  # INDX bytes -> IndxKey of the file dumped with them
 
     with alive_bar(len(game_file_addresses),
                                 title='Dumping from memory..',
                                 theme='smooth',
-                                length=20) as bar:
+                                length=20) as bar, DumpWriter() as writer:
         for address in game_file_addresses:
             bar()
-            hex_result = split_hex_into_spaces(str(read_bytes(address, 64).hex()))
-            start_addr = get_start_of_game_text(address)  # make sure we start on the first byte of the first letter
-            if start_addr is not None:
-                end_addr = find_first_match(start_addr, foot_pattern)
-                if end_addr is not None:
-                    bytes_to_read = end_addr - start_addr
-                    if bytes_to_read < 0:
-                        continue
-                    game_data = read_bytes(start_addr, bytes_to_read).rstrip(b'\x00').hex()
-                    if len(game_data) % 2 != 0:
-                        game_data = game_data + '0'
-
-                    try:
-                        game_data = bytes.fromhex(game_data).decode('utf-8')
-                    except UnicodeDecodeError:
-                        continue  # incomplete files are sometimes loaded. ignore them
-                    game_data = game_data.replace('\x0a', '\x7c')
-                    game_data = game_data.replace('\x00', '\x0a')
-                    game_data = game_data.replace('\x09', '\x5c\x74')
-
-                    jsondata_ja = {}
-                    jsondata_en = {}
-                    number = 1
-
-                    for line in game_data.split('\n'):
-                        json_data_ja = __format_to_json(jsondata_ja, line, 'ja', number)
-                        json_data_en = __format_to_json(jsondata_en, line, 'en', number)
-                        number += 1
-
-                    json_data_ja = json.dumps(
-                        jsondata_ja,
-                        indent=2,
-                        sort_keys=False,
-                        ensure_ascii=False
-                    )
-
-                    json_data_en = json.dumps(
-                        jsondata_en,
-                        indent=2,
-                        sort_keys=False,
-                        ensure_ascii=False
-                    )
-
-                    file = 'clarity_' + str((random.randint(1, 1000000000))) + '.json'
-                    json_path_ja = 'json_out/ja'
-                    json_path_en = 'json_out/en'
-
-                    write_file(json_path_ja, file, 'w+', json_data_ja)
-                    write_file(json_path_en, file, 'w+', json_data_en)
-
-                    matching_file = compare_jsons(file)
-
-                    # stage files for migration
-                    if matching_file:
-                        copy2(f'json_out/en/{file}', f'hyde_json_merge/dst/{matching_file}')  # stage new file for port
-                        copy2(f'json_out/ja/{file}', f'json/_lang/ja/{matching_file}')  # move new ja to new folder
-                        copy2(f'../../json/_lang/en/{matching_file}', 'hyde_json_merge/src')  # stage orig file for port
-                        write_dict(f'json\_lang\en\{file}', f'json\_lang\en\{matching_file}', skip_file_read=True, hex_bytes=hex_result)
-                    else:
-                        print(f'No match found for {file}.')  # nothing to port b/c new file. move new files and do nothing
-                        copy2(f'json_out/en/{file}', f'json/_lang/en')  # move new en to new folder
-                        copy2(f'json_out/ja/{file}', f'json/_lang/ja')  # move new ja to new folder
-                        write_dict(f'json\_lang\en\{file}', f'json\_lang\en\{file}', skip_file_read=True, hex_bytes=hex_result)
-
-def sort_csv():
-    '''
-    Ensures only unique lines are present and sorts them, then writes to a final hex_dict.csv file.
-    '''
-    lines_seen = set()
-    outfile = open('hex_dict.csv', 'w')
-    for line in open('bms_hex_dict.csv', 'r'):
-        if line not in lines_seen: # not a duplicate
-            lines_seen.add(line)
-    outfile.writelines(sorted(lines_seen))
-    outfile.close()
+            evt = read_evt(address)
+            if evt is None:
+                continue
+            # clarity finds files by their INDX bytes, so only the first file with them is dumped
+            if evt.indx in dumped:
+                if evt.key is not None and dumped[evt.indx] is not None and evt.key != dumped[evt.indx]:
+                    print(f'File at {hex(address)} shares its INDX bytes with a different file that was already dumped. Skipped.')
+                continue
+            dumped[evt.indx] = evt.key
 
-if __name__ == '__main__':
+            hex_result = split_hex_into_spaces(evt.indx.hex())
+            json_data_ja, json_data_en, strings = evt_to_json(evt.strings)
+            file = content_name(evt.indx, evt.strings) + '.json'
+            matching_file = compare_jsons(file, strings)
+
+            # never overwrite a file that's already staged for another INDX key
+            if matching_file and query_csv(matching_file, compare_type='filename'):
+                print(f'{file} matched {matching_file}, which was already dumped under other INDX bytes. Skipped.')
+                continue
+
+            # stage files for migration
+            if matching_file:
+                writer.write(f'hyde_json_merge/dst/{matching_file}', json_data_en)  # stage new file for port
+                writer.write(f'json/_lang/ja/{matching_file}', json_data_ja)  # new ja goes to new folder
+                copy2(f'../../json/_lang/en/{matching_file}', 'hyde_json_merge/src')  # stage orig file for port
+                write_dict(f'json\_lang\en\{file}', f'json\_lang\en\{matching_file}', skip_file_read=True, hex_bytes=hex_result, key=evt.key)
+            else:
+                print(f'No match found for {file}.')  # nothing to port b/c new file. write new files and do nothing
+                writer.write(f'json/_lang/en/{file}', json_data_en)
+                writer.write(f'json/_lang/ja/{file}', json_data_ja)
+                write_dict(f'json\_lang\en\{file}', f'json\_lang\en\{file}', skip_file_read=True, hex_bytes=hex_result, key=evt.key)
+
+def main():
     clean_workspace()
 
     # dump files from memory and place in folders to process
     # DQX needs to be open for this step
     dump_all_game_files()
 
-    dir_count = len(listdir('dqx_out'))
-
-    with alive_bar(dir_count,
+    evt_files = listdir('dqx_out')
+
+    # files that haven't changed since the last port are carried over as they are.
+    # pass --full to port everything again
+    migration = MigrationManifest(full='--full' in sys.argv)
+    statuses = migration.check('dqx_out', evt_files)
+    changed_files = []
+    for file in evt_files:
+        entry = migration.previous_entry(file) if statuses[file] == UNCHANGED else None
+        if entry is None or (entry['json'] and not path.exists(f"../../{entry['json']}")):
+            changed_files.append(file)
+            continue
+
+        migration.record(file, entry['indx'], entry['json'], entry['key'])
+        if entry['json'] is None or has_entry(entry['indx'], entry['key'], file) or entry['json'] in get_hex_dict().files:
+            continue
+        ja_json = entry['json'].replace('\\en', '\\ja')
+        copy2(f"../../{entry['json']}", 'json/_lang/en')  # copy en to new folder
+        copy2(f'../../{ja_json}', 'json/_lang/ja')
+        write_dict(file, entry['json'], skip_file_read=True, hex_bytes=entry['indx'], key=entry['key'])
+
+    print(f'{len(evt_files) - len(changed_files)} EVT files unchanged since the last port.')
+
+    # parsing, json conversion and matching happen on a process pool. everything
+    # that writes files or reads the hex dict happens here, in order
+    with alive_bar(len(changed_files),
             title='Analyzing EVTs..',
             theme='smooth',
             length=20) as bar:
-        for file in listdir('dqx_out'):
+        for results in analyze_evts(changed_files):
             bar()
-            if query_csv(f'dqx_out/{file}'):  # if we dumped it from memory already, don't do double work
+            file = results['file']
+            if results['error']:
+                print(f"Skipping {file}: {results['error']}")
+                migration.record(file)
                 continue
 
-            if check_blacklist(f'dqx_out/{file}'):
+            hex_result = split_hex_into_spaces(results['indx'].hex())
+            if has_entry(results['indx'], results['key'], file):  # if we dumped it from memory already, don't do double work
                 continue
 
-            bounds = get_text_range(file)
-            num_to_read = bounds[1] - bounds[0]  # read in data we care about
-
-            with open(f'dqx_out/{file}', 'rb') as f:
-                s = f.seek(bounds[0])
-                s = f.read(num_to_read)
-
-            game_data = s.rstrip(b'\x00')
-            game_data = game_data.hex()
-
-            game_data = bytes.fromhex(game_data).decode('utf-8')
-
-            # sanitize hex for weblate
-            game_data = sanitize_bytes(game_data)
-
-            jsondata_ja = {}
-            jsondata_en = {}
-            number = 1
-
-            # create json string
-            for line in game_data.split('\n'):
-                json_data_ja = format_to_json(jsondata_ja, line, 'ja', number)
-                json_data_en = format_to_json(jsondata_en, line, 'en', number)
-                number += 1
-
-            # format to actual json
-            json_data_ja = json.dumps(jsondata_ja, indent=2, sort_keys=False, ensure_ascii=False)
-            json_data_en = json.dumps(jsondata_en, indent=2, sort_keys=False, ensure_ascii=False)
+            if results['blacklisted']:
+                migration.record(file, hex_result, key=results['key'])
+                continue
 
             # write en and ja json to file
             json_file = path.splitext(file)[0] + '.json'
@@ -358,10 +279,12 @@ if __name__ == '__main__':
             Path(json_path_ja).mkdir(parents=True, exist_ok=True)
             Path(json_path_en).mkdir(parents=True, exist_ok=True)
 
-            write_file(json_path_ja, json_file, 'w+', json_data_ja)
-            write_file(json_path_en, json_file, 'w+', json_data_en)
+            write_file(json_path_ja, json_file, 'w+', results['json_ja'])
+            write_file(json_path_en, json_file, 'w+', results['json_en'])
 
-            matching_file = compare_jsons(json_file)
+            matching_file = results['matching_file']
+            if matching_file and results['other_candidates']:
+                print(f"{json_file} matched {matching_file} (confidence {results['confidence']}) over {', '.join(results['other_candidates'])}.")
 
             # stage files for migration
             if matching_file:
@@ -374,46 +297,40 @@ if __name__ == '__main__':
                 copy2(f'json_out/en/{json_file}', f'hyde_json_merge/dst/{matching_file}')  # stage new file for port
                 copy2(f'json_out/ja/{json_file}', f'json/_lang/ja/{matching_file}')  # move new ja to new folder
                 copy2(f'../../json/_lang/en/{matching_file}', 'hyde_json_merge/src')  # stage orig file for port
-                write_dict(f'{file}', f'json\_lang\en\{matching_file}')
+                write_dict(f'{file}', f'json\_lang\en\{matching_file}', skip_file_read=True, hex_bytes=hex_result, key=results['key'])
+                migration.record(file, hex_result, f'json\\_lang\\en\\{matching_file}', results['key'])
             else:
                 # nothing to port b/c new file. move new files and do nothing
                 copy2(f'json_out/en/{json_file}', f'json/_lang/en')  # move new en to new folder
                 copy2(f'json_out/ja/{json_file}', f'json/_lang/ja')  # move new ja to new folder
-                write_dict(f'{file}', f'json\_lang\en\{json_file}')
+                write_dict(f'{file}', f'json\_lang\en\{json_file}', skip_file_read=True, hex_bytes=hex_result, key=results['key'])
+                migration.record(file, hex_result, f'json\\_lang\\en\\{json_file}', results['key'])
 
-    # run hyde's json migration and move files dumped in out to new folder. this is now our new json batch
-    exe = "hyde_json_merge\json-conv.exe"
-
-    for filename in listdir('hyde_json_merge/src'):
-        system(f'{exe} -s hyde_json_merge/src/{filename} -d hyde_json_merge/dst/{filename} -o hyde_json_merge/out/{filename}')
+    # carry our translations over to the new files and move them from out to the new folder. this is now our new json batch
+    for filename in merge_folders('hyde_json_merge/src', 'hyde_json_merge/dst', 'hyde_json_merge/out'):
         copy2(f'hyde_json_merge/out/{filename}', 'json/_lang/en')
 
     # we need to go back and check our existing hex dict. not all files in memory or these dumps will
-    # be accounted for and were dumped as they were encountered in game. query the current hex_dict
-    # and port those values over.
-    with open('../hex_dict.csv', 'r') as source, open('bms_hex_dict.csv', 'r') as dest:
-        source_file = source.readlines()
-        dest_file = dest.readlines()
-
-    # make a new list with only filenames
-    new_dest_file = []
-    for line in dest_file:
-        new_dest_file.append(line.split(',')[0])
-
-    # query our existing csv. if an entry in here isn't in the new one, add it. also, move the file over to json/_lang
-    for line in source_file:
-        filename = line.split(',')[0]
-        hex_value = line.split(',')[1].rstrip()
-        if filename not in new_dest_file:
-            write_dict(filename, filename, skip_file_read=True, hex_bytes=hex_value)
-            ja_filename = filename.replace('\en', '\ja')
+    # be accounted for and were dumped as they were encountered in game. the files our new hex dict
+    # doesn't have keep their existing entries. move those files over to json/_lang
+    for filename, hex_value in read_hex_dict('../hex_dict.csv'):
+        if filename not in get_hex_dict().files:
+            ja_filename = filename.replace('\\en', '\\ja')
             copy2(f'../../{filename}', 'json/_lang/en')  # copy en to new folder
             copy2(f'../../{ja_filename}', 'json/_lang/ja')
 
-    # ensure our new csv is sorted and has unique records
-    sort_csv()
+    # merge both into a sorted hex_dict.csv with one file per INDX key
+    for hex_value, kept, dropped in build_hex_dict('bms_hex_dict.csv', '../hex_dict.csv', 'hex_dict.csv'):
+        print(f'{hex_value} is in both {kept} and {dropped}. Kept {kept}.')
+
+    migration.save()
+    counts = migration.write_report()
+    print(', '.join(f'{count} {status}' for status, count in counts.items()) + ' EVT files. See migration_report.csv.')
 
     # clean up space, but leave json folder and new hex_dict.csv
     rmtree('json_out')
     rmtree('dqx_out')
     remove('bms_hex_dict.csv')
+
+if __name__ == '__main__':
+    main()
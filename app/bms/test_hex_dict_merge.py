@@ -0,0 +1,72 @@
+'''
+Tests for hex_dict_merge on a large made up pair of hex dicts.
+
+    python -m pytest test_hex_dict_merge.py
+'''
+from pathlib import Path
+import random
+import sys
+sys.path[:0] = [str(Path(__file__).parent), str(Path(__file__).parent.parent)]
+import pytest
+from hex_dict_merge import HEX_DICT_HEADER, build_hex_dict, read_hex_dict
+
+FILES = 50000
+SEED = 1
+
+def _write(csv_file: Path, rows: list):
+    with open(csv_file, 'w') as f:
+        f.write(HEX_DICT_HEADER)
+        f.writelines(f'{file},{hex_string}\n' for file, hex_string in rows)
+
+@pytest.fixture(scope='module')
+def merged(tmp_path_factory):
+    '''
+    Merges a new dict of FILES files, with every line twice, and an old dict with
+    a quarter of those files under keys the new dict no longer has, FILES files
+    only it has and one file that shares a key with a new file.
+    '''
+    rng = random.Random(SEED)
+
+    def key():
+        return ' '.join(f'{rng.randrange(256):02X}' for _ in range(64))
+
+    dic = dict()
+    dic['new'] = [(f'clarity_new_{i}', key()) for i in range(FILES)]
+    dic['superseded'] = [(f'clarity_new_{i}', key()) for i in range(0, FILES, 4)]
+    dic['old_only'] = [(f'clarity_old_{i}', key()) for i in range(FILES)]
+    dic['conflict'] = ('clarity_old_conflict', dic['new'][0][1])
+    old_rows = dic['superseded'] + dic['old_only'] + [dic['conflict']]
+    rng.shuffle(old_rows)
+
+    folder = tmp_path_factory.mktemp('hex_dicts')
+    _write(folder / 'new.csv', dic['new'] + dic['new'])
+    _write(folder / 'old.csv', old_rows)
+    dic['conflicts'] = build_hex_dict(str(folder / 'new.csv'), str(folder / 'old.csv'), str(folder / 'out.csv'))
+    dic['rows'] = read_hex_dict(folder / 'out.csv')
+    dic['lines'] = (folder / 'out.csv').read_text().splitlines()
+
+    return dic
+
+def test_every_key_is_written_once(merged):
+    keys = [hex_string for _, hex_string in merged['rows']]
+    assert len(keys) == len(set(keys)) == len(merged['new']) + len(merged['old_only'])
+
+def test_lines_are_sorted(merged):
+    assert merged['lines'][0] == HEX_DICT_HEADER.strip()
+    assert merged['lines'][1:] == sorted(merged['lines'][1:])
+
+def test_new_entries_are_kept(merged):
+    entries = {hex_string: file for file, hex_string in merged['rows']}
+    assert all(entries.get(hex_string) == file for file, hex_string in merged['new'])
+
+def test_superseded_old_entries_are_dropped(merged):
+    entries = {hex_string for _, hex_string in merged['rows']}
+    assert not any(hex_string in entries for _, hex_string in merged['superseded'])
+
+def test_old_only_entries_are_kept(merged):
+    entries = {hex_string: file for file, hex_string in merged['rows']}
+    assert all(entries.get(hex_string) == file for file, hex_string in merged['old_only'])
+
+def test_conflicting_key_stays_with_the_new_file(merged):
+    file, hex_string = merged['conflict']
+    assert merged['conflicts'] == [(hex_string, merged['new'][0][0], file)]
@@ -0,0 +1,113 @@
+'''
+Buffered logging for the hook and game text logs.
+
+In clarity's processes loggers only put records on a queue. A listener thread per
+log file writes them out in batches, flushing once the queue runs dry, and rotates
+the file when it gets too big.
+
+Inside DQX a thread only runs while a hook holds the GIL, so no listener is
+started there. Records stay in the file's buffer and the hook runtime writes them
+out once at the end of each hook call with flush_log_buffers.
+'''
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+import atexit
+import logging
+import os
+from common import in_game_process
+
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+# log file -> handler. one per file and process
+_log_handlers = dict()
+# file handlers used directly inside DQX, written out by flush_log_buffers
+_buffered_handlers = []
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    '''
+    RotatingFileHandler that leaves flushing to its listener and keeps track of
+    the file size itself instead of seeking to the end for every record.
+    '''
+    def __init__(self, filename, maxBytes, backupCount, encoding='utf-8'):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding, delay=True)
+        try:
+            self.bytes_written = os.path.getsize(self.baseFilename)
+        except OSError:
+            self.bytes_written = 0
+
+    def flush(self):
+        pass  # see flush_buffer
+
+    def flush_buffer(self):
+        '''Writes out everything emitted since the last flush.'''
+        super().flush()
+
+    def shouldRollover(self, record):
+        if self.maxBytes <= 0:
+            return 0
+        return self.bytes_written + len(self.format(record).encode(self.encoding)) + 1 >= self.maxBytes
+
+    def doRollover(self):
+        try:
+            super().doRollover()
+        except OSError:
+            # another process (DQX or the hook server) still has the file open. keep
+            # appending and try again once another maxBytes has been written
+            if self.stream is None:
+                self.stream = self._open()
+        self.bytes_written = 0
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            msg = self.format(record) + self.terminator
+            self.stream.write(msg)
+            self.bytes_written += len(msg.encode(self.encoding))
+        except Exception:
+            self.handleError(record)
+
+class BatchingQueueListener(QueueListener):
+    '''QueueListener that flushes its handlers whenever it's about to wait for more records.'''
+    def dequeue(self, block):
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush_buffer()
+        return self.queue.get(block)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        super().stop()
+        for handler in self.handlers:
+            handler.flush_buffer()
+            handler.close()
+
+def get_log_handler(log_file: str, formatter: logging.Formatter) -> logging.Handler:
+    '''
+    Returns the handler for log_file, creating it on first use. That's a queue
+    handler with its own listener in clarity's processes and the buffered file
+    handler itself inside DQX.
+    '''
+    if log_file not in _log_handlers:
+        file_handler = BufferedRotatingFileHandler(log_file, LOG_MAX_BYTES, LOG_BACKUP_COUNT)
+        file_handler.setFormatter(formatter)
+        if in_game_process():
+            _buffered_handlers.append(file_handler)
+            _log_handlers[log_file] = file_handler
+        else:
+            queue = SimpleQueue()
+            listener = BatchingQueueListener(queue, file_handler)
+            listener.start()
+            atexit.register(listener.stop)
+            _log_handlers[log_file] = QueueHandler(queue)
+
+    return _log_handlers[log_file]
+
+def flush_log_buffers():
+    '''Writes out the records buffered inside DQX. Does nothing in clarity's processes.'''
+    for handler in _buffered_handlers:
+        handler.flush_buffer()
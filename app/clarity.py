@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from collections import OrderedDict
 from pathlib import Path
 import csv
 import json
@@ -8,7 +9,6 @@ import shutil
 import sys
 import time
 import zipfile
-import random
 from alive_progress import alive_bar
 import pykakasi
 from loguru import logger
@@ -26,8 +26,26 @@ from translate import (
     sqlite_write,
     detect_lang,
     determine_translation_service,
-    sanitized_dialog_translate
+    sanitized_dialog_translate,
+    sanitized_dialog_translate_batch,
+    queue_prefetch,
+    read_prefetch_queue,
+    remove_from_prefetch_queue
 )
+from translation_memory import (
+    from_json_string,
+    build_translation_memory,
+    build_fuzzy_translation_memory,
+    save_memory
+)
+from hex_validation import validated_stamp
+from common import process_file_name
+from bms.evt import content_name
+from hook_ipc import serve_hook_requests
+from hook_events import HookEventRing, STATUS_NAMES
+from buffered_logging import get_log_handler
+from tracing import span
+from metrics import counter, histogram, write_snapshot
 from memory import (
     read_bytes,
     read_string,
@@ -47,8 +65,37 @@ from signatures import (
     walkthrough_pattern
 )
 
+ADHOC_FILES_WRITTEN = counter('adhoc_files_written_total', 'Translated adhoc files written into DQX\'s memory.')
+ADHOC_FILES_DUMPED = counter('adhoc_files_dumped_total', 'Unknown adhoc files dumped to new_adhoc_dumps.')
+NAMES_REWRITTEN = counter('names_rewritten_total', 'Names replaced in DQX\'s memory, by kind.')
+HOOK_SECONDS = histogram('hook_seconds', 'Time DQX spent in each hook, by hook and status.')
+HOOK_TEXT_LENGTH = histogram('hook_text_length', 'Characters of text handled per hook hit, by hook.', buckets=tuple(2 ** i for i in range(13)))
+HOOK_EVENTS_DROPPED = counter('hook_events_dropped_total', 'Hook events dropped because the hook event ring was full.')
+
+NEW_HEX_DICT = 'new_adhoc_dumps/new_hex_dict.csv'
+
+_new_adhoc_keys = None
+
+# file -> (stamp it passed validation with, its hex) of the most recently used
+# validated files. see generate_hex
+_validated_hex = OrderedDict()
+# files kept in _validated_hex. the hooks run inside DQX's 32 bit process too
+VALIDATED_HEX_CACHE_SIZE = 32
+
 def generate_hex(file):
-    '''Parses a nested json file to convert strings to hex.'''
+    '''
+    Parses a nested json file to convert strings to hex. Files that passed
+    hex_validation.py and haven't changed since aren't length checked, and the
+    last VALIDATED_HEX_CACHE_SIZE of them are reused instead of converted again.
+    '''
+    stamp = validated_stamp(file)
+    validated = stamp is not None
+    if validated:
+        cached = _validated_hex.get(file)
+        if cached is not None and cached[0] == stamp:
+            _validated_hex.move_to_end(file)
+            return cached[1]
+
     en_hex_to_write = ''
     data = read_json_file(file)
     for item in data:
@@ -68,7 +115,7 @@ def generate_hex(file):
             else:
                 en = ja
                 en_len = ja_len
-            if en_len > ja_len:
+            if en_len > ja_len and not validated:
                 logger.error('\n')
                 logger.error('String too long. Please fix and try again.')
                 logger.error(f'File: {file}.json')
@@ -87,6 +134,11 @@ def generate_hex(file):
                         break
         en_hex_to_write += en
 
+    if validated:
+        _validated_hex[file] = (stamp, en_hex_to_write)
+        _validated_hex.move_to_end(file)
+        if len(_validated_hex) > VALIDATED_HEX_CACHE_SIZE:
+            _validated_hex.popitem(last=False)
 
     return en_hex_to_write
 
@@ -171,11 +223,13 @@ def translate():
 
     logging.warning('')
 
-def write_adhoc_entry(start_addr: int, hex_str: str) -> dict:
+def write_adhoc_entry(start_addr: int, hex_str: str, prefetch: bool = False) -> dict:
     '''
     Checks the stored json files for a matching adhoc file. If found,
     converts the json into bytes and writes bytes at the appropriate
     address.
+
+    prefetch: Queue every line of a newly dumped file to be translated in the background
     '''
     results = dict()
     hex_result = split_hex_into_spaces(hex_str)
@@ -189,23 +243,20 @@ def write_adhoc_entry(start_addr: int, hex_str: str) -> dict:
                 text_address = get_start_of_game_text(index_address)
                 if text_address:
                     write_bytes(text_address, hex_to_write)
+                    ADHOC_FILES_WRITTEN.inc(source='hook')
                     results['success'] = True
                     results['file'] = file
                     return results
     else:
         results['success'] = False
-        filename = str(random.randint(1, 1000000000))
         Path('new_adhoc_dumps/en').mkdir(parents=True, exist_ok=True)
         Path('new_adhoc_dumps/ja').mkdir(parents=True, exist_ok=True)
 
-        csv_path = 'new_adhoc_dumps/new_hex_dict.csv'
-        new_csv = Path(csv_path)
-        if new_csv.is_file():
-            csv_result = query_csv(hex_result, csv_path)
-            if csv_result:  # if we have an entry, don't make another one
-                results['file'] = None
-                return results
-        else:
+        new_adhoc_keys = get_new_adhoc_keys()
+        if hex_result in new_adhoc_keys:  # if we have an entry, don't make another one
+            results['file'] = None
+            return results
+        if not Path(NEW_HEX_DICT).is_file():
             write_file('new_adhoc_dumps', 'new_hex_dict.csv', 'a', 'file,hex_string\n')
 
         # get number of bytes to read from start
@@ -213,16 +264,160 @@ def write_adhoc_entry(start_addr: int, hex_str: str) -> dict:
         end_address = find_first_match(begin_address, foot_pattern)
         bytes_to_read = end_address - begin_address
 
-        # dump game file
+        # dump game file. it's named after its contents, so dumping it again (here or
+        # by another session) gives the same file
         game_file = dump_game_file(begin_address, bytes_to_read)
         ja_data = game_file['ja']
         en_data = game_file['en']
+        filename = content_name(bytes.fromhex(hex_str), game_file['strings'])
+        # the hook server's workers each keep their own key set, so another process
+        # may have dumped this file already. it has the same name if it did
+        if Path(f'new_adhoc_dumps/en/{filename}.json').is_file():
+            new_adhoc_keys.add(hex_result)
+            results['file'] = None
+            return results
         write_file('new_adhoc_dumps', 'new_hex_dict.csv', 'a', f'{filename},{hex_result}\n')
         write_file('new_adhoc_dumps/ja', f'{filename}.json', 'w', ja_data)
         write_file('new_adhoc_dumps/en', f'{filename}.json', 'w', en_data)
+        new_adhoc_keys.add(hex_result)
+        if prefetch:
+            queue_prefetch(get_prefetch_lines(ja_data), filename)
+        ADHOC_FILES_DUMPED.inc()
         results['file'] = filename
         return results
 
+def get_new_adhoc_keys() -> set:
+    '''
+    INDX keys (spaced, like the hex dict has them) of the files in
+    new_adhoc_dumps/new_hex_dict.csv. Read on first use, then kept up to date by
+    write_adhoc_entry. Only has the files this process knows about, so
+    write_adhoc_entry also checks for the dumped file before writing its row.
+    '''
+    global _new_adhoc_keys
+    if _new_adhoc_keys is None:
+        _new_adhoc_keys = set()
+        if Path(NEW_HEX_DICT).is_file():
+            with open(NEW_HEX_DICT) as f:
+                _new_adhoc_keys.update(row['hex_string'] for row in csv.DictReader(f))
+
+    return _new_adhoc_keys
+
+def get_prefetch_lines(ja_data: str) -> list:
+    '''
+    Returns the lines of a dumped json file as the game has them in memory,
+    skipping the blank and full width space placeholders.
+    '''
+    lines = []
+    for item in json.loads(ja_data).values():
+        for ja in item:
+            if not ja.startswith(('clarity_nt_char', 'clarity_ms_space')):
+                lines.append(from_json_string(ja))
+
+    return lines
+
+def prefetch_translations(batch_size=50):
+    '''
+    Translates lines queued from newly dumped game files in batches and stores them in
+    the dialog table, so by the time the player reaches them they're already translated.
+    '''
+    api_details = determine_translation_service()
+    if api_details['EnablePrefetch'] != 'True':
+        return
+
+    logger.info('Starting translation prefetch.')
+    region = api_details['RegionCode']
+
+    while True:
+        try:
+            lines = read_prefetch_queue(batch_size)
+            if not lines:
+                time.sleep(1)
+                continue
+
+            untranslated = [line for line in lines if sqlite_read(line, region, 'dialog') is None]
+            translations = sanitized_dialog_translate_batch(
+                api_details['TranslateService'],
+                api_details['IsPro'],
+                untranslated,
+                api_details['TranslateKey'],
+                region
+            )
+            for line, translated_text in zip(untranslated, translations):
+                if translated_text == line:
+                    continue  # not japanese
+                try:
+                    sqlite_write(line, 'dialog', translated_text, region)
+                except Exception:
+                    continue
+            remove_from_prefetch_queue(lines)
+            logger.debug(f'Prefetched {len(untranslated)} lines.')
+        except Exception as e:
+            logger.warning(f'Prefetch failed. Trying again in 30 seconds.\nMessage: {e}')
+            time.sleep(30)
+
+def build_translation_memories():
+    '''
+    Builds the translation memories from the json files and the dialog table and
+    saves them to corpus_cache/. The hooks and the prefetcher load the saved copies,
+    so they never build them on the game thread.
+    '''
+    region = determine_translation_service()['RegionCode']
+
+    start = time.perf_counter()
+    memory = build_translation_memory()
+    save_memory(memory, 'translation')
+    logger.debug(f'Built translation memory of {len(memory)} lines in {time.perf_counter() - start:.2f}s.')
+
+    start = time.perf_counter()
+    memory = build_fuzzy_translation_memory(region)
+    save_memory(memory, f'fuzzy_{region.lower()}')
+    logger.debug(f'Built fuzzy translation memory of {len(memory)} lines in {time.perf_counter() - start:.2f}s.')
+
+def run_hook_server():
+    '''
+    Serves hook requests from DQX so the hooks' heavy work (SQLite, translation
+    requests, language detection) runs across clarity's worker processes instead
+    of on the game thread.
+    '''
+    if determine_translation_service()['EnableHookServer'] != 'True':
+        return
+
+    from hook_runtime import run_hook_locally  # imports clarity, so can't be imported at the top
+    serve_hook_requests(run_hook_locally)
+
+def read_hook_events(interval=0.1):
+    '''
+    Creates the shared memory ring the hooks write their events into and drains it
+    into the hook_seconds and hook_text_length histograms. Writes the metrics
+    snapshot the hooks publish through it to metrics/.
+    '''
+    try:
+        ring = HookEventRing(create=True)
+    except FileExistsError:
+        logger.warning('Hook event ring already exists. Is another instance of clarity running?')
+        return
+
+    dropped = 0
+    try:
+        while True:
+            for event in ring.pop_all():
+                duration = (event.finished_ns - event.started_ns) / 1e9
+                status = STATUS_NAMES.get(event.status, str(event.status))
+                HOOK_SECONDS.observe(duration, hook=event.hook, status=status)
+                HOOK_TEXT_LENGTH.observe(event.text_length, hook=event.hook)
+                logger.debug(f'{event.hook} @ {hex(event.address)}: {event.text_length} characters in {duration * 1000:.2f}ms ({status})')
+            if (total_dropped := ring.dropped()) != dropped:
+                HOOK_EVENTS_DROPPED.inc(total_dropped - dropped)
+                dropped = total_dropped
+            if (data := ring.read_snapshot()) is not None:
+                try:
+                    write_snapshot(process_file_name('DQX'), json.loads(data))
+                except (OSError, ValueError):
+                    pass
+            time.sleep(interval)
+    finally:
+        ring.close()
+
 def scan_for_adhoc_files():
     '''
     Scans for specific adhoc files that have yet to have a hook written for them.
@@ -238,12 +433,14 @@ def scan_for_adhoc_files():
 
     while True:
         try:
-            index_list = pattern_scan(pattern=index_pattern, return_multiple=True)
+            with span('adhoc.pattern_scan'):
+                index_list = pattern_scan(pattern=index_pattern, return_multiple=True)
 
             for index_address in index_list:
                 if read_bytes(index_address - 2, 1) != b'\x69':
                     hex_result = split_hex_into_spaces(str(read_bytes(index_address, 64).hex()))
-                    csv_result = query_csv(hex_result)
+                    with span('adhoc.query_csv'):
+                        csv_result = query_csv(hex_result)
                     if csv_result:
                         file = csv_result['file']
                         if 'adhoc_wd_' in file:
@@ -260,8 +457,10 @@ def scan_for_adhoc_files():
 
                                 # with the match we found, make sure the INDX is still here before we write
                                 if split_hex_into_spaces(str(read_bytes(index_address, 64).hex())) == hex_result:
-                                    write_bytes(text_address, hex_to_write)
+                                    with span('adhoc.write_bytes'):
+                                        write_bytes(text_address, hex_to_write)
                                     write_bytes(index_address - 2, b'\x69')  # our mark that we wrote here so we don't write again. nice.
+                                    ADHOC_FILES_WRITTEN.inc(source='scanner')
                                     logger.debug(f'Wrote {file} @ {hex(index_address)}')
                         elif ('adhoc_cs_' in file) and (cutscenes == True):
                             hex_to_write = bytes.fromhex(generate_hex(file))
@@ -277,8 +476,10 @@ def scan_for_adhoc_files():
 
                                 # with the match we found, make sure the INDX is still here before we write
                                 if split_hex_into_spaces(str(read_bytes(index_address, 64).hex())) == hex_result:
-                                    write_bytes(text_address, hex_to_write)
+                                    with span('adhoc.write_bytes'):
+                                        write_bytes(text_address, hex_to_write)
                                     write_bytes(index_address - 2, b'\x69')  # our mark that we wrote here so we don't write again. nice.
+                                    ADHOC_FILES_WRITTEN.inc(source='scanner')
                                     logger.debug(f'Wrote {file} @ {hex(index_address)}')                                                                        
             else:
                 time.sleep(.001)
@@ -402,7 +603,8 @@ def scan_for_overworld_names():
         # Player name scanning
         if player_names:
             try:
-                player_list = pattern_scan(pattern=player_name_byte_pattern, return_multiple=True)
+                with span('overworld.player_pattern_scan'):
+                    player_list = pattern_scan(pattern=player_name_byte_pattern, return_multiple=True)
                 if player_list != []:
                     for address in player_list:
                         player_name_address = address + 17
@@ -413,6 +615,7 @@ def scan_for_overworld_names():
 
                         romaji_name = kks.convert(ja_player_name)[0]['hepburn'].capitalize()
                         write_bytes(player_name_address, b'\x04' + romaji_name.encode('utf-8') + b'\x00')
+                        NAMES_REWRITTEN.inc(kind='player')
             except TypeError:
                 logger.warning('Cannot find DQX process. Must have closed? Exiting.')
                 sys.exit()
@@ -420,7 +623,8 @@ def scan_for_overworld_names():
         # NPC name scanning
         if npc_names:
             try:
-                index_list = pattern_scan(pattern=npc_monster_byte_pattern, return_multiple=True)
+                with span('overworld.npc_pattern_scan'):
+                    index_list = pattern_scan(pattern=npc_monster_byte_pattern, return_multiple=True)
 
                 if index_list != []:
                     for address in index_list:
@@ -458,12 +662,14 @@ def scan_for_overworld_names():
                         if data == "AI_NAME":
                             romaji_name = kks.convert(name)[0]['hepburn'].capitalize()
                             write_bytes(name_addr, b'\x04' + romaji_name.encode('utf-8') + b'\x00')
+                            NAMES_REWRITTEN.inc(kind='ai')
                         else:
                             for item in data:
                                 key, value = list(data[item].items())[0]
                                 if re.search(f'^{name}+$', key):
                                     if value:
                                         write_bytes(name_addr, str.encode(value) + b'\x00')
+                                        NAMES_REWRITTEN.inc(kind='monster' if data is monster_data else 'npc')
             except TypeError:
                 logger.warning('Cannot find DQX process. Must have closed? Exiting.')
                 sys.exit()
@@ -481,7 +687,9 @@ def scan_for_menu_ai_names():
         # Menu AI name scanning
         try:
             if not ai_addresses_found:
-                if ai_list := pattern_scan(pattern=menu_ai_name_byte_pattern, return_multiple=True):
+                with span('menu_ai.pattern_scan'):
+                    ai_list = pattern_scan(pattern=menu_ai_name_byte_pattern, return_multiple=True)
+                if ai_list:
                     ai_addresses_found = True
             if ai_addresses_found:
                 for address in ai_list:
@@ -490,6 +698,7 @@ def scan_for_menu_ai_names():
                         if ja_ai_name := read_string(ai_name_address):
                             romaji_ai_name = kks.convert(ja_ai_name)[0]['hepburn'].capitalize()
                             write_bytes(ai_name_address, romaji_ai_name.encode('utf-8') + b'\x00')
+                            NAMES_REWRITTEN.inc(kind='menu_ai')
                         else:
                             continue
                     except UnicodeDecodeError:
@@ -509,26 +718,30 @@ def scan_for_walkthrough():
     
     while True:
         try:
-            if address := pattern_scan(pattern=walkthrough_pattern):
+            with span('walkthrough.pattern_scan'):
+                address = pattern_scan(pattern=walkthrough_pattern)
+            if address:
                 prev_text = ''
                 while True:
                         if text := read_string(address + 16):
                             if text != prev_text:
                                 prev_text = text
                                 if detect_lang(text):
-                                    result = sqlite_read(text, 'en', 'walkthrough')
+                                    with span('walkthrough.sqlite_read'):
+                                        result = sqlite_read(text, 'en', 'walkthrough')
                                     if result:
                                         write_string(address + 16, result)
                                     else:
-                                        translated_text = sanitized_dialog_translate(
-                                            api_details['TranslateService'],
-                                            api_details['IsPro'], 
-                                            text,
-                                            api_details['TranslateKey'],
-                                            api_details['RegionCode'],
-                                            text_width=31,
-                                            max_lines=3
-                                        )
+                                        with span('walkthrough.translate'):
+                                            translated_text = sanitized_dialog_translate(
+                                                api_details['TranslateService'],
+                                                api_details['IsPro'], 
+                                                text,
+                                                api_details['TranslateKey'],
+                                                api_details['RegionCode'],
+                                                text_width=31,
+                                                max_lines=3
+                                            )
                                         sqlite_write(
                                             text,
                                             'walkthrough',
@@ -550,12 +763,18 @@ def scan_for_walkthrough():
 def dump_game_file(start_addr: int, num_bytes_to_read: int):
     '''
     Dumps a game file given its start and end address. Formats into a json
-    friendly file to be used by clarity for both ja and en.
+    friendly file to be used by clarity for both ja and en. strings has the
+    file's strings as they are in memory.
 
     start_addr: Where to start our read operation to dump (should start at TEXT)
     num_bytes_to_read: How many bytes should we should dump from the start_addr
     '''
-    game_data = read_bytes(start_addr, num_bytes_to_read).hex().strip('00')
+    raw_data = read_bytes(start_addr, num_bytes_to_read)
+    # split the way bms/evt.py's parse_evt_data does, so content_name gives this file
+    # the same name as port_to_json's dump of it
+    strings = raw_data.rstrip(b'\x00').decode('utf-8').split('\x00')
+
+    game_data = raw_data.hex().strip('00')
     if len(game_data) % 2 != 0:
         game_data = game_data + '0'
 
@@ -589,6 +808,7 @@ def dump_game_file(start_addr: int, num_bytes_to_read: int):
     dic = dict()
     dic['ja'] = json_data_ja
     dic['en'] = json_data_en
+    dic['strings'] = strings
 
     return dic
 
@@ -658,18 +878,19 @@ def split_hex_into_spaces(hex_str: str):
 
 def setup_logger(name, log_file, func_name, level=logging.INFO):
     '''
-    Sets up a logger for hook shellcode.
+    Sets up a logger for hook shellcode. Records are buffered and written to a
+    rotating log_file in batches (see buffered_logging), so logging doesn't block
+    the hook. Calling this again for the same logger reuses its handler.
     '''
     formatter = logging.Formatter('%(message)s')
-    handler = logging.FileHandler(log_file, encoding='utf-8')
-    handler.setFormatter(formatter)
+    handler = get_log_handler(log_file, formatter)
 
     logger = logging.getLogger(name)
-    if (logger.hasHandlers()):
-        logger.handlers.clear()
-
     logger.setLevel(level)
-    logger.addHandler(handler)
+    if handler not in logger.handlers:
+        logger.handlers.clear()
+        logger.addHandler(handler)
+        logger.propagate = False
 
     return logger
 
@@ -0,0 +1,42 @@
+'''
+Small helpers shared by the modules that write files about a clarity process
+(metrics, traces, profiles) and by the caches and manifests written next to them.
+'''
+from contextlib import contextmanager
+from multiprocessing import current_process
+from pathlib import Path
+import os
+import re
+import sys
+
+def in_game_process() -> bool:
+    '''Whether this code is running inside DQX's embedded interpreter, where sys.executable is the game.'''
+    return not Path(sys.executable).name.lower().startswith('python')
+
+def process_file_name(name=None) -> str:
+    '''
+    Name for a file that belongs to this process: its name in lowercase with
+    anything but letters and digits turned into _, then its pid.
+    '''
+    if name is None:
+        name = current_process().name
+    return re.sub(r'\W+', '_', name).strip('_').lower() + f'_{os.getpid()}'
+
+@contextmanager
+def atomic_write(path, mode='w', encoding='utf-8', newline=None):
+    '''
+    Opens a temp file next to path and moves it over path once the with block is
+    done, so readers never see half a file. Nothing is replaced if the block raises.
+    '''
+    temp_path = f'{path}.tmp'
+    binary = 'b' in mode
+    try:
+        with open(temp_path, mode, encoding=None if binary else encoding, newline=None if binary else newline) as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
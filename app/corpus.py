@@ -0,0 +1,138 @@
+'''
+Loads a whole folder of json/_lang files at once.
+
+Each file is flattened into parallel lists of entry numbers, Japanese strings
+and English strings. Files are parsed on a process pool (with orjson if it's
+installed) and the result is cached in corpus_cache/, so the next load only
+parses the files whose size or mtime changed.
+'''
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
+from multiprocessing import current_process
+from pathlib import Path
+import json
+import os
+import pickle
+import sys
+from common import atomic_write, in_game_process
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+JSON_LANG_PATH = 'json/_lang/en'
+CORPUS_CACHE_DIRECTORY = 'corpus_cache'
+CORPUS_CACHE_VERSION = 1
+
+# fewer changed files than this are parsed in this process. starting a pool costs more
+MIN_FILES_FOR_POOL = 32
+
+# error is None unless the file couldn't be read, in which case the lists are empty
+CorpusFile = namedtuple('CorpusFile', ['stamp', 'numbers', 'ja', 'en', 'error'])
+
+def _stamp(path) -> tuple:
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+def parse_corpus_file(path: str) -> CorpusFile:
+    '''Reads a json/_lang file into a CorpusFile.'''
+    numbers = []
+    ja = []
+    en = []
+    try:
+        stamp = _stamp(path)
+        with open(path, 'rb') as f:
+            data = _loads(f.read())
+        for number, entry in data.items():
+            key, value = list(entry.items())[0]
+            numbers.append(number)
+            ja.append(key)
+            en.append(value)
+    except (OSError, ValueError, AttributeError, IndexError) as e:
+        return CorpusFile(None, [], [], [], f'{type(e).__name__}: {e}')
+
+    return CorpusFile(stamp, numbers, ja, en, None)
+
+def can_use_pool() -> bool:
+    '''
+    Whether this process can start a process pool. Not from daemon processes, and
+    not from inside DQX, where sys.executable is the game.
+    '''
+    if current_process().daemon:
+        return False
+    return not in_game_process()
+
+def load_corpus(path=JSON_LANG_PATH, workers=None, use_cache=True) -> dict:
+    '''
+    Returns {file name: CorpusFile} for every json file in path, sorted by name.
+
+    workers: Processes to parse with. Defaults to one per CPU. 1 parses in this process
+    use_cache: Reuse the cached parse of files that haven't changed
+    '''
+    cache_path = _cache_path(path)
+    cached = _read_cache(cache_path) if use_cache else dict()
+
+    corpus = dict()
+    to_parse = []
+    for file in sorted(Path(path).glob('*.json')):
+        entry = cached.get(file.name)
+        try:
+            unchanged = entry is not None and entry.error is None and entry.stamp == _stamp(file)
+        except OSError:
+            unchanged = False
+        corpus[file.name] = entry if unchanged else None
+        if not unchanged:
+            to_parse.append(str(file))
+
+    if len(to_parse) >= MIN_FILES_FOR_POOL and workers != 1 and can_use_pool():
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(to_parse) // ((workers or os.cpu_count() or 1) * 4))
+            parsed = executor.map(parse_corpus_file, to_parse, chunksize=chunksize)
+            for file, corpus_file in zip(to_parse, parsed):
+                corpus[Path(file).name] = corpus_file
+    else:
+        for file in to_parse:
+            corpus[Path(file).name] = parse_corpus_file(file)
+
+    if to_parse or len(corpus) != len(cached):
+        try:
+            _write_cache(cache_path, corpus)
+        except OSError:
+            pass  # only makes the next load slower
+
+    return corpus
+
+def _cache_path(path) -> Path:
+    '''One cache file per folder, named after its absolute path.'''
+    folder = os.path.abspath(path)
+    digest = sha1(folder.encode('utf-8')).hexdigest()[:16]
+    return Path(CORPUS_CACHE_DIRECTORY, f'{Path(folder).name}_{digest}.pickle')
+
+def _read_cache(cache_path: Path) -> dict:
+    try:
+        with open(cache_path, 'rb') as f:
+            data = pickle.load(f)
+    except Exception:
+        return dict()  # missing, truncated or from another version
+    if not isinstance(data, dict) or data.get('version') != CORPUS_CACHE_VERSION:
+        return dict()
+
+    return data['files']
+
+def _write_cache(cache_path: Path, corpus: dict):
+    cache_path.parent.mkdir(exist_ok=True)
+    with atomic_write(cache_path, 'wb') as f:
+        pickle.dump({'version': CORPUS_CACHE_VERSION, 'files': corpus}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+if __name__ == '__main__':
+    import time
+
+    path = sys.argv[1] if len(sys.argv) > 1 else JSON_LANG_PATH
+    for name, workers, use_cache in (('In one process', 1, False), ('On a pool', None, False), ('From the cache', None, True)):
+        start = time.perf_counter()
+        corpus = load_corpus(path, workers=workers, use_cache=use_cache)
+        strings = sum(len(corpus_file.ja) for corpus_file in corpus.values())
+        print(f'{name}: {len(corpus)} files ({strings} strings) in {time.perf_counter() - start:.2f}s')
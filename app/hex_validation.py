@@ -0,0 +1,182 @@
+'''
+Offline length check of every translated json file.
+
+A translated string is written over the Japanese one in game memory, so it can't
+take up more bytes than the Japanese string did. generate_hex only notices an
+overflow when the file is being written into the game. This checks the whole
+json/_lang/en corpus against json/_lang/ja up front, reports every string that's
+too long and writes a manifest of the files that passed, so generate_hex can skip
+checking them again and convert each of them only once. Run this file from the app folder:
+
+    python hex_validation.py [--workers N] [--no-cache]
+'''
+from pathlib import Path
+import csv
+import json
+import os
+import re
+import sys
+import click
+from common import atomic_write
+from corpus import load_corpus, CorpusFile
+
+EN_DIRECTORY = 'json/_lang/en'
+JA_DIRECTORY = 'json/_lang/ja'
+VALIDATED_MANIFEST = 'validated_manifest.json'
+OVERFLOW_REPORT = 'overflow_report.csv'
+MANIFEST_VERSION = 2
+
+REPORT_FIELDS = ['file', 'number', 'problem', 'budget', 'length', 'ja', 'en']
+
+# problems. only too long strings and unreadable files keep a file out of the manifest
+TOO_LONG = 'too long'
+NOT_IN_JAPANESE_FILE = 'not in japanese file'
+NO_JAPANESE_FILE = 'no japanese file'
+WARNINGS = (NOT_IN_JAPANESE_FILE, NO_JAPANESE_FILE)
+
+# manifest path -> (manifest mtime, {file: stamp}). loaded once per process
+_manifest_cache = dict()
+
+def _stamp(path) -> list:
+    '''Returns what's used to tell whether a file changed since it was validated.'''
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _byte_length(value: str) -> int:
+    '''Bytes a string takes up in game memory, including its terminator.'''
+    return len(value.encode('utf-8')) + 1
+
+def validate_file(en_file: str, en: CorpusFile, ja=None) -> list:
+    '''
+    Checks each string in en fits in the bytes of the Japanese string it
+    translates. Strings are looked up by text in ja, the same file's Japanese
+    version, since entries move around between game versions. Returns a list of
+    problems, each a dict with the REPORT_FIELDS.
+    '''
+    problems = []
+
+    def problem(number, kind, budget='', length='', ja='', en=''):
+        problems.append({
+            'file': en_file, 'number': number, 'problem': kind,
+            'budget': budget, 'length': length, 'ja': ja, 'en': en
+        })
+
+    if en.error:
+        problem('', f'unreadable: {en.error}')
+        return problems
+
+    if ja is None or ja.error:
+        ja_strings = None
+        problem('', NO_JAPANESE_FILE)
+    else:
+        ja_strings = set(ja.ja)
+
+    for number, key, value in zip(en.numbers, en.ja, en.en):
+        if re.search('^clarity_(nt_char|ms_space)', key):
+            continue
+        if ja_strings is not None and key not in ja_strings:
+            problem(number, NOT_IN_JAPANESE_FILE, ja=key, en=value)
+        if not value:
+            continue
+
+        budget = _byte_length(key)
+        length = _byte_length(value)
+        if length > budget:
+            problem(number, TOO_LONG, budget, length, key, value)
+
+    return problems
+
+def validate_corpus(en_directory=EN_DIRECTORY, ja_directory=JA_DIRECTORY,
+                    manifest=VALIDATED_MANIFEST, workers=None, use_cache=True) -> list:
+    '''
+    Validates every json file in en_directory and writes the files that passed
+    to manifest. Both folders are read with the corpus loader, so on a process
+    pool and only re-parsing files that changed. Returns every problem found.
+    '''
+    en_corpus = load_corpus(en_directory, workers=workers, use_cache=use_cache)
+    ja_corpus = load_corpus(ja_directory, workers=workers, use_cache=use_cache)
+
+    problems = []
+    validated = dict()
+    for name, en in en_corpus.items():
+        en_file = Path(en_directory, name).as_posix()
+        file_problems = validate_file(en_file, en, ja_corpus.get(name))
+        problems.extend(file_problems)
+        if all(problem['problem'] in WARNINGS for problem in file_problems):
+            validated[en_file] = {'stamp': list(en.stamp)}
+
+    _write_manifest(manifest, validated)
+
+    return problems
+
+def _read_manifest(manifest=VALIDATED_MANIFEST) -> dict:
+    try:
+        with open(manifest, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    if data.get('version') != MANIFEST_VERSION:
+        return dict()
+
+    return data.get('files', dict())
+
+def _write_manifest(manifest, files: dict):
+    with atomic_write(manifest) as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': files}, f, indent=2, sort_keys=True)
+
+def write_overflow_report(problems: list, report=OVERFLOW_REPORT):
+    '''Writes every problem found to a CSV file.'''
+    with open(report, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(problems)
+
+def validated_stamp(file: str, manifest=VALIDATED_MANIFEST):
+    '''
+    Returns the size and mtime file had when it passed validation if it hasn't
+    changed since, otherwise None. Takes paths as hex_dict.csv has them (with backslashes).
+    '''
+    try:
+        manifest_mtime = os.stat(manifest).st_mtime_ns
+    except OSError:
+        return None
+    cached = _manifest_cache.get(manifest)
+    if cached is None or cached[0] != manifest_mtime:
+        cached = _manifest_cache[manifest] = (manifest_mtime, _read_manifest(manifest))
+
+    entry = cached[1].get(file.replace('\\', '/'))
+    if entry is None:
+        return None
+    try:
+        stamp = _stamp(file)
+    except OSError:
+        return None
+
+    return tuple(stamp) if entry['stamp'] == stamp else None
+
+@click.command()
+@click.option('--en', 'en_directory', default=EN_DIRECTORY, help='''Folder of translated json files.''')
+@click.option('--ja', 'ja_directory', default=JA_DIRECTORY, help='''Folder of the Japanese json files to measure against.''')
+@click.option('--workers', type=int, default=None, help='''Number of processes to use. Defaults to one per CPU.''')
+@click.option('--no-cache', is_flag=True, help='''Parses every file again instead of using the corpus cache.''')
+def main(en_directory, ja_directory, workers, no_cache):
+    problems = validate_corpus(en_directory, ja_directory, workers=workers, use_cache=not no_cache)
+    write_overflow_report(problems)
+
+    failures = [problem for problem in problems if problem['problem'] not in WARNINGS]
+    for problem in failures:
+        if problem['problem'] == TOO_LONG:
+            click.echo(f"{problem['file']} #{problem['number']}: {problem['length']} bytes, only {problem['budget']} fit")
+            click.echo(f"  JA: {problem['ja']}")
+            click.echo(f"  EN: {problem['en']}")
+        else:
+            click.echo(f"{problem['file']}: {problem['problem']}")
+
+    files_with_failures = len({problem['file'] for problem in failures})
+    click.echo(f'{len(problems) - len(failures)} warnings about text missing from the Japanese files.')
+    click.secho(f'{len(failures)} problems in {files_with_failures} files. Report written to {OVERFLOW_REPORT}',
+                fg='red' if failures else 'green')
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
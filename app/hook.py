@@ -24,6 +24,7 @@ from api_translate.dialog import translate_shellcode, load_evtx_shellcode
 #from api_translate.cutscene import cutscene_shellcode
 from api_translate.quest import quest_text_shellcode
 from api_translate.walkthrough import walkthrough_shellcode
+from api_translate.resident import loader_shellcode
 from hook_mgmt.hide_hooks import load_unload_hooks
 from translate import determine_translation_service
 
@@ -213,8 +214,14 @@ def generic_detour(hook_name: str, pre_hook: dict, signature: bytes, num_bytes_t
         # write our shellcode
         write_string(shellcode_addr, shellcode)
 
+        # PyRun_SimpleString only compiles this small loader each hit. the shellcode
+        # itself is compiled once and cached inside the game's interpreter
+        loader = loader_shellcode(shellcode_addr, shellcode)
+        loader_addr = allocate_memory(len(loader))
+        write_string(loader_addr, loader)
+
         bytecode = (b'\xE8' + calc_rel_addr(pre_hook['begin_hook_insts'], py_initialize_ex_addr))  # call py_initialize_ex_addr
-        bytecode += (b'\x68' + bytes(pack_to_int(shellcode_addr))) # push shellcode_addr
+        bytecode += (b'\x68' + bytes(pack_to_int(loader_addr))) # push loader_addr
         bytecode += (b'\xE8' + calc_rel_addr(pre_hook['begin_hook_insts'] + len(bytecode), pyrun_simplestring_addr)) # push py_run_simple_string_addr
 
         # write our hook code
@@ -276,7 +283,8 @@ def translate_detour(debug: bool):
         api_details['IsPro'],
         api_details['EnableDialogLogging'],
         api_details['RegionCode'],
-        debug)
+        debug,
+        prefetch=api_details['EnablePrefetch'])
 
     detour = generic_detour(
         inspect.currentframe().f_code.co_name,
@@ -397,7 +405,8 @@ def load_indx_detour():
     pre_hook = write_pre_hook_registers()
     ecx = pre_hook['reg_ecx']
 
-    shellcode = load_evtx_shellcode(ecx)
+    api_details = determine_translation_service()
+    shellcode = load_evtx_shellcode(ecx, prefetch=api_details['EnablePrefetch'])
 
     detour = generic_detour(
         inspect.currentframe().f_code.co_name,
@@ -0,0 +1,183 @@
+'''
+Ring buffer in shared memory that the hooks write event records into.
+
+There's exactly one producer (the hook runtime inside DQX, which only ever runs
+on the game thread) and one consumer (clarity's hook event reader), so no locks
+are needed: the producer is the only one writing head and the consumer is the
+only one writing tail. A record is written before head is moved past it, so the
+consumer never sees a half written record. When the buffer is full, events are
+dropped and counted rather than making the game thread wait.
+
+After the records there's one slot for the hook runtime's metrics snapshot (see
+metrics), since DQX can't run a thread to export it. It's guarded by a sequence
+number that's odd while the producer is writing, so the consumer can tell when it
+read a snapshot that was being replaced and simply tries again next time.
+'''
+from collections import namedtuple
+from multiprocessing import shared_memory
+import struct
+import sys
+
+HOOK_EVENTS_NAME = 'dqxclarity_hook_events'
+HOOK_EVENTS_CAPACITY = 4096  # records. must be a power of two
+
+HOOK_IDS = {
+    'dialog_hook': 1,
+    'load_evtx_hook': 2,
+    'quest_text_hook': 3,
+    'walkthrough_hook': 4,
+}
+HOOK_NAMES = {hook_id: name for name, hook_id in HOOK_IDS.items()}
+
+# what happened to the hook
+EVENT_OK = 0
+EVENT_FORWARDED = 1  # ran in clarity's hook server
+EVENT_ERROR = 2
+STATUS_NAMES = {EVENT_OK: 'ok', EVENT_FORWARDED: 'forwarded', EVENT_ERROR: 'error'}
+
+MAGIC = b'DQXE'
+VERSION = 2
+
+# magic, version, capacity, record size, snapshot capacity. head and tail get their own cache lines
+HEADER = struct.Struct('<4sHIII')
+HEAD_OFFSET = 64      # u64 written by the producer
+DROPPED_OFFSET = 72   # u64 written by the producer
+TAIL_OFFSET = 128     # u64 written by the consumer
+RECORDS_OFFSET = 192
+
+COUNTER = struct.Struct('<Q')
+
+# hook id, status, address, text length, started and finished (perf_counter_ns)
+RECORD = struct.Struct('<HHIIQQ4x')
+
+# sequence, length of the snapshot that follows
+SNAPSHOT_HEADER = struct.Struct('<QI4x')
+SNAPSHOT_CAPACITY = 256 * 1024  # bytes
+
+HookEvent = namedtuple('HookEvent', ['hook', 'status', 'address', 'text_length', 'started_ns', 'finished_ns'])
+
+class HookEventRing:
+    '''
+    Single producer, single consumer ring of hook event records.
+
+    name: Name of the shared memory block
+    capacity: Number of records. Only used when creating
+    create: Create the block (consumer) instead of attaching to it (producer)
+    '''
+    def __init__(self, name=HOOK_EVENTS_NAME, capacity=HOOK_EVENTS_CAPACITY, create=False):
+        if create:
+            if capacity & (capacity - 1):
+                raise ValueError('capacity must be a power of two')
+            size = RECORDS_OFFSET + capacity * RECORD.size + SNAPSHOT_HEADER.size + SNAPSHOT_CAPACITY
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, capacity, RECORD.size, SNAPSHOT_CAPACITY)
+            for offset in (HEAD_OFFSET, DROPPED_OFFSET, TAIL_OFFSET):
+                COUNTER.pack_into(self.shm.buf, offset, 0)
+            SNAPSHOT_HEADER.pack_into(self.shm.buf, RECORDS_OFFSET + capacity * RECORD.size, 0, 0)
+            snapshot_capacity = SNAPSHOT_CAPACITY
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            if sys.platform != 'win32':
+                # the resource tracker would unlink the block when the producer exits
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            magic, version, capacity, record_size, snapshot_capacity = HEADER.unpack_from(self.shm.buf, 0)
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                self.shm.close()
+                raise ValueError(f'{name} is not a version {VERSION} hook event ring')
+
+        self.owner = create
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.snapshot_offset = RECORDS_OFFSET + capacity * RECORD.size
+        self.snapshot_capacity = snapshot_capacity
+        self.snapshot_sequence = 0  # last snapshot the consumer read
+
+    def push(self, hook: str, address: int, text_length: int, started_ns: int, finished_ns: int, status=EVENT_OK) -> bool:
+        '''
+        Writes an event. Returns False (and counts it as dropped) if the ring is full.
+        Only call from the producer.
+        '''
+        buf = self.shm.buf
+        head = COUNTER.unpack_from(buf, HEAD_OFFSET)[0]
+        tail = COUNTER.unpack_from(buf, TAIL_OFFSET)[0]
+        if head - tail >= self.capacity:
+            dropped = COUNTER.unpack_from(buf, DROPPED_OFFSET)[0]
+            COUNTER.pack_into(buf, DROPPED_OFFSET, dropped + 1)
+            return False
+
+        offset = RECORDS_OFFSET + (head & self.mask) * RECORD.size
+        RECORD.pack_into(buf, offset, HOOK_IDS.get(hook, 0), status, address & 0xFFFFFFFF, text_length, started_ns, finished_ns)
+        COUNTER.pack_into(buf, HEAD_OFFSET, head + 1)  # publish only once the record is complete
+
+        return True
+
+    def pop_all(self, limit=None) -> list:
+        '''
+        Returns every event written since the last call, oldest first.
+        Only call from the consumer.
+        '''
+        buf = self.shm.buf
+        head = COUNTER.unpack_from(buf, HEAD_OFFSET)[0]
+        tail = COUNTER.unpack_from(buf, TAIL_OFFSET)[0]
+        if limit is not None:
+            head = min(head, tail + limit)
+
+        events = []
+        for position in range(tail, head):
+            offset = RECORDS_OFFSET + (position & self.mask) * RECORD.size
+            hook_id, status, address, text_length, started_ns, finished_ns = RECORD.unpack_from(buf, offset)
+            events.append(HookEvent(HOOK_NAMES.get(hook_id, str(hook_id)), status, address, text_length, started_ns, finished_ns))
+        COUNTER.pack_into(buf, TAIL_OFFSET, head)  # hand the slots back to the producer
+
+        return events
+
+    def publish_snapshot(self, data: bytes) -> bool:
+        '''
+        Replaces the snapshot. Returns False if it doesn't fit.
+        Only call from the producer.
+        '''
+        if len(data) > self.snapshot_capacity:
+            return False
+        buf = self.shm.buf
+        sequence = SNAPSHOT_HEADER.unpack_from(buf, self.snapshot_offset)[0]
+        SNAPSHOT_HEADER.pack_into(buf, self.snapshot_offset, sequence + 1, 0)  # odd while writing
+        start = self.snapshot_offset + SNAPSHOT_HEADER.size
+        buf[start:start + len(data)] = data
+        SNAPSHOT_HEADER.pack_into(buf, self.snapshot_offset, sequence + 2, len(data))
+
+        return True
+
+    def read_snapshot(self):
+        '''
+        Returns the snapshot if a new one was published since the last call, otherwise None.
+        Only call from the consumer.
+        '''
+        buf = self.shm.buf
+        sequence, length = SNAPSHOT_HEADER.unpack_from(buf, self.snapshot_offset)
+        if sequence & 1 or sequence == self.snapshot_sequence:
+            return None
+        start = self.snapshot_offset + SNAPSHOT_HEADER.size
+        data = bytes(buf[start:start + length])
+        if SNAPSHOT_HEADER.unpack_from(buf, self.snapshot_offset)[0] != sequence:
+            return None  # replaced while copying
+        self.snapshot_sequence = sequence
+
+        return data
+
+    def dropped(self) -> int:
+        '''Returns how many events were dropped because the ring was full.'''
+        return COUNTER.unpack_from(self.shm.buf, DROPPED_OFFSET)[0]
+
+    def close(self):
+        '''Detaches from the ring. The consumer also removes it.'''
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def attach_hook_events(name=HOOK_EVENTS_NAME):
+    '''Returns the producer's end of the ring, or None if clarity hasn't created it.'''
+    try:
+        return HookEventRing(name)
+    except (FileNotFoundError, ValueError):
+        return None
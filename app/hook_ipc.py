@@ -0,0 +1,167 @@
+'''
+Channel between the hooks running inside DQX and the clarity process.
+
+Hooks post the entry point they were triggered for and the register addresses
+they were given. clarity runs the hook in a pool of worker processes (which
+reach into DQX's memory with pymem, the same way the scanners do) and replies
+once the text has been written back, so SQLite, HTTP and langdetect never run
+on the game thread.
+
+Every request gets a (reply, error) answer. error is only set when clarity itself
+couldn't run the request (a worker died, for example), and the client raises
+ConnectionError for it so the hook runs in DQX instead.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Client, Listener
+from threading import Lock, Thread
+from traceback import format_exc
+import time
+from loguru import logger
+
+HOOK_SERVER_ADDRESS = r'\\.\pipe\dqxclarity_hooks'
+HOOK_SERVER_AUTHKEY = b'dqxclarity'
+
+# seconds to wait for clarity to finish a hook before giving up on it
+HOOK_SERVER_TIMEOUT = 15
+
+# seconds to wait before trying to reconnect after clarity couldn't be reached
+HOOK_SERVER_RETRY = 5
+
+class HookServerClient:
+    '''
+    Game side of the channel. Connects lazily and reconnects after failures.
+    '''
+    def __init__(self, address=HOOK_SERVER_ADDRESS, authkey=HOOK_SERVER_AUTHKEY, timeout=HOOK_SERVER_TIMEOUT):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self.conn = None
+        self.retry_at = 0
+
+    def _connect(self) -> bool:
+        if self.conn is not None:
+            return True
+        if time.monotonic() < self.retry_at:
+            return False
+        try:
+            self.conn = Client(self.address, authkey=self.authkey)
+        except Exception:
+            self.retry_at = time.monotonic() + HOOK_SERVER_RETRY
+            return False
+
+        return True
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except OSError:
+                pass
+        self.conn = None
+
+    def call(self, entry_point: str, args: tuple):
+        '''
+        Asks clarity to run entry_point with args, waits for it to finish and
+        returns the handler's reply.
+
+        Raises ConnectionError if clarity couldn't be reached or couldn't run the
+        request, in which case the caller should run the hook itself. Raises TimeoutError if clarity got the
+        request but didn't answer in time. It may still write to the text then,
+        so the hook shouldn't be run a second time.
+        '''
+        if not self._connect():
+            raise ConnectionError('Hook server is not reachable.')
+
+        try:
+            self.conn.send((entry_point, args))
+        except (OSError, EOFError):
+            self.close()
+            self.retry_at = time.monotonic() + HOOK_SERVER_RETRY
+            raise ConnectionError('Lost connection to the hook server.')
+
+        try:
+            answered = self.conn.poll(self.timeout)
+            if answered:
+                reply, error = self.conn.recv()
+        except (OSError, EOFError):
+            answered = False
+
+        if not answered:
+            # a fresh connection keeps a late reply from being read as the answer to the next request
+            self.close()
+            raise TimeoutError(f'Hook server did not finish {entry_point} in time.')
+        if error is not None:
+            raise ConnectionError(f'Hook server could not run {entry_point}.')
+
+        return reply
+
+class WorkerPool:
+    '''
+    Process pool that starts over with a new pool once one of its workers has died.
+    A ProcessPoolExecutor fails every request after that otherwise.
+    '''
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.lock = Lock()
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+
+    def run(self, func, *args):
+        '''Runs func(*args) in a worker and returns what it returned.'''
+        pool = self.pool
+        try:
+            return pool.submit(func, *args).result()
+        except BrokenProcessPool:
+            with self.lock:
+                if self.pool is pool:  # the other connections' threads see the same broken pool
+                    logger.warning('A hook server worker died. Starting new workers.')
+                    pool.shutdown(wait=False)
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            raise
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+def _serve_connection(conn, pool: WorkerPool, handler):
+    '''Runs each request from one connection on the pool and replies when it's done.'''
+    with conn:
+        while True:
+            try:
+                entry_point, args = conn.recv()
+            except (OSError, EOFError):
+                return
+            try:
+                reply = (pool.run(handler, entry_point, args), None)
+            except Exception:
+                error = format_exc()
+                reply = (None, error)
+                logger.error(f'Hook server failed to run {entry_point}.\n{error}')
+            try:
+                conn.send(reply)
+            except (OSError, EOFError):
+                return
+
+def serve_hook_requests(handler, workers=None, address=HOOK_SERVER_ADDRESS, authkey=HOOK_SERVER_AUTHKEY):
+    '''
+    Accepts connections from the hooks and runs their requests on a process pool
+    until the listener is closed.
+
+    handler: Picklable function called with (entry_point, args) in a worker. What it
+        returns is sent back to the hook
+    workers: Number of worker processes. Defaults to the number of cores
+    '''
+    pool = WorkerPool(workers)
+    try:
+        with Listener(address, authkey=authkey) as listener:
+            logger.info(f'Hook server listening on {address}')
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError:
+                    return
+                except Exception as e:
+                    logger.warning(f'Rejected hook server connection: {e}')
+                    continue
+                Thread(target=_serve_connection, args=(conn, pool, handler), daemon=True).start()
+    finally:
+        pool.shutdown()
@@ -14,6 +14,10 @@ from signatures import (
     loading_offsets,
 #    cutscene_pattern
 )
+from metrics import counter
+
+HOOKS_LOADED = counter('hooks_loaded_total', 'Times the hooks were written back after a loading screen.')
+HOOKS_UNLOADED = counter('hooks_unloaded_total', 'Times the hooks were removed for a loading screen.')
 
 def unpack_to_int(address: int):
     '''
@@ -59,11 +63,13 @@ def load_unload_hooks(hook_list: list, debug: bool):
                 for hook in hook_list:
                     write_bytes(hook['detour_address'], hook['original_bytes'])
                 logger.debug('Hooks unloaded.')
+                HOOKS_UNLOADED.inc()
                 state = 0
             elif state_byte == b'\x01' and state == 0:  # we're ok to hook now
                 for hook in hook_list:
                     write_bytes(hook['detour_address'], hook['hook_bytes'])
                 logger.debug('Hooks loaded.')
+                HOOKS_LOADED.inc()
                 state = 1
 
             # cutscene logic
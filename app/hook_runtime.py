@@ -0,0 +1,358 @@
+'''
+Resident runtime for hook shellcode.
+
+The first time any hook fires, its shellcode imports this module into DQX's
+Python interpreter. Everything below (imports, loggers, the translation memory,
+provider sessions) stays warm in sys.modules from then on, so every later hook
+hit is a single call into one of the *_hook functions.
+
+With EnableHookServer on, the *_hook functions hand their work to clarity's hook
+server (see hook_ipc) and only fall back to running in DQX when it can't be
+reached. The server's workers import this module too and call run_hook_locally.
+'''
+from functools import wraps
+from time import monotonic, perf_counter_ns
+from traceback import format_exc
+import json
+import logging
+# re-exported: the loader stub calls hook_runtime.run_cached_shellcode (see api_translate.resident)
+from api_translate.resident import run_cached_shellcode  # pylint: disable=unused-import
+from buffered_logging import flush_log_buffers
+from clarity import write_adhoc_entry, setup_logger
+from errors import AddressOutOfRange
+from hook import unpack_to_int
+from memory import (
+    read_bytes,
+    write_bytes,
+    read_string,
+    find_first_match,
+    scan_backwards
+)
+from hook_events import attach_hook_events, EVENT_OK, EVENT_FORWARDED, EVENT_ERROR
+from hook_ipc import HookServerClient, HOOK_SERVER_RETRY
+from metrics import snapshot, METRICS_EXPORT_INTERVAL
+from signatures import index_pattern, foot_pattern
+from tracing import span, record
+from translate import (
+    determine_translation_service,
+    sanitized_dialog_translate,
+    sqlite_read,
+    sqlite_write,
+    detect_lang,
+    query_string_from_file,
+    clean_up_and_return_items,
+    quest_translate
+)
+
+_loggers = dict()
+_hook_server = {'client': None, 'checked_at': None}
+_hook_events = {'ring': None, 'retry_at': 0, 'publish_at': 0}
+
+# seconds between attempts to attach to clarity's hook event ring
+HOOK_EVENTS_RETRY = 5
+
+def get_logger(name: str, log_file: str, func_name: str) -> logging.Logger:
+    '''
+    Returns a hook logger. The file handler is only set up on first use instead of
+    being torn down and recreated on every hook hit.
+    '''
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = setup_logger(name, log_file, func_name)
+        _loggers[name] = logger
+
+    return logger
+
+def get_hook_server_client():
+    '''
+    Returns the client used to reach clarity's hook server, or None if the
+    hook server is turned off. The setting is read again (at most every
+    HOOK_SERVER_RETRY seconds) whenever the client isn't connected, so turning it
+    on or off doesn't need DQX to be restarted.
+    '''
+    client = _hook_server['client']
+    if client is not None and client.conn is not None:
+        return client
+    checked_at = _hook_server['checked_at']
+    if checked_at is not None and monotonic() < checked_at + HOOK_SERVER_RETRY:
+        return client
+    _hook_server['checked_at'] = monotonic()
+
+    if determine_translation_service()['EnableHookServer'] == 'True':
+        if client is None:
+            client = HookServerClient()
+    elif client is not None:
+        client.close()
+        client = None
+    _hook_server['client'] = client
+
+    return client
+
+def record_hook_event(hook: str, address: int, text_length: int, started_ns: int, status: int):
+    '''
+    Writes an event for clarity's hook event reader. Does nothing until clarity
+    has created the ring and never blocks if the reader falls behind.
+    '''
+    ring = _hook_events['ring']
+    if ring is None:
+        if monotonic() < _hook_events['retry_at']:
+            return
+        ring = attach_hook_events()
+        if ring is None:
+            _hook_events['retry_at'] = monotonic() + HOOK_EVENTS_RETRY
+            return
+        _hook_events['ring'] = ring
+
+    ring.push(hook, address, text_length, started_ns, perf_counter_ns(), status)
+
+def publish_metrics():
+    '''
+    Hands this process's metrics snapshot to clarity's hook event reader every
+    METRICS_EXPORT_INTERVAL seconds. It writes the snapshot to metrics/ for the
+    metrics server, so the hook never touches the disk for it.
+    '''
+    ring = _hook_events['ring']
+    if ring is None or monotonic() < _hook_events['publish_at']:
+        return
+    _hook_events['publish_at'] = monotonic() + METRICS_EXPORT_INTERVAL
+    ring.publish_snapshot(json.dumps(snapshot()).encode('utf-8'))
+
+def out_of_process(func):
+    '''
+    Runs the hook in clarity's hook server when it's enabled and reachable,
+    otherwise runs it here, then records a hook event. Hooks return the address and
+    length of the text they handled. The original function stays available as run_locally.
+    '''
+    @wraps(func)
+    def wrapper(*args):
+        started_ns = perf_counter_ns()
+        text_address = 0
+        text_length = 0
+        status = EVENT_OK
+        try:
+            client = get_hook_server_client()
+            if client is not None:
+                try:
+                    text_address, text_length, error = client.call(func.__name__, args)
+                    status = EVENT_ERROR if error else EVENT_FORWARDED
+                    return
+                except ConnectionError:
+                    pass
+                except TimeoutError:
+                    status = EVENT_ERROR
+                    raise
+            text_address, text_length = func(*args) or (0, 0)
+        except:
+            status = EVENT_ERROR
+            raise
+        finally:
+            record(func.__name__, perf_counter_ns() - started_ns)
+            record_hook_event(func.__name__, text_address, text_length, started_ns, status)
+            publish_metrics()
+            flush_log_buffers()
+
+    wrapper.run_locally = func
+    return wrapper
+
+def run_hook_locally(entry_point: str, args: tuple) -> tuple:
+    '''
+    Runs a hook in this process. Used by the hook server's workers. Returns the
+    address and length of the text the hook handled and the traceback if it raised.
+    '''
+    try:
+        text_address, text_length = globals()[entry_point].run_locally(*args) or (0, 0)
+        return text_address, text_length, None
+    except AddressOutOfRange:
+        return 0, 0, None
+    except:
+        error = format_exc()
+        get_logger('out', 'out.log', 'hook_server').error(error)
+        return 0, 0, error
+
+def dump_adhoc_file(adhoc_address: int, adhoc_bytes: bytes, prefetch: bool) -> dict:
+    '''
+    Writes the adhoc file starting at adhoc_address and logs what happened.
+    adhoc_bytes: First 64 bytes of the file, used to look it up in hex_dict
+    '''
+    logger = get_logger('out', 'out.log', 'adhoc')
+    adhoc_write = write_adhoc_entry(adhoc_address, str(adhoc_bytes.hex()), prefetch=prefetch)
+    if adhoc_write['success']:
+        logger.info('Wrote adhoc file (' + str(adhoc_write['file']) + ')')
+    elif adhoc_write['file'] is not None:
+        logger.info('New adhoc file. Writing to new_adhoc_dumps.')
+    elif adhoc_write['file'] is None:
+        logger.info('This file already exists in new_adhoc_dumps. Needs merge into github.')
+
+    return adhoc_write
+
+@out_of_process
+def dialog_hook(
+    eax_address: int,
+    ebx_address: int,
+    api_service: str,
+    api_key: str,
+    api_pro: str,
+    api_logging: bool,
+    api_region: str,
+    prefetch: bool):
+    '''
+    Translates the text in the dialog window. Returns the address and length of the text.
+    eax_address: Where text can be modified to be fed to the screen
+    ebx_address: NPC name
+    '''
+    logger = get_logger('out', 'out.log', 'translate')
+    game_text_logger = get_logger('gametext', 'game_text.log', 'game_text')
+
+    try:
+        # get address values where text can be identified
+        npc_address = unpack_to_int(ebx_address)[0]
+        ja_address = unpack_to_int(eax_address)[0]
+
+        with span('dialog.read_string'):
+            ja_text = read_string(ja_address)
+
+        if api_logging:
+            game_text_logger.info(ja_text)
+
+        with span('dialog.detect_lang'):
+            is_japanese = detect_lang(ja_text)
+        if not is_japanese:
+            logger.info('English detected. Doing nothing.')
+            return ja_address, len(ja_text)
+
+        with span('dialog.find_first_match'):
+            foot_address = find_first_match(ja_address, foot_pattern)
+        if foot_address != False:
+            logger.info('Adhoc address found @ ' + str(hex(ja_address)))
+            with span('dialog.scan_backwards'):
+                adhoc_address = scan_backwards(ja_address, index_pattern)
+            if adhoc_address:
+                if read_bytes(adhoc_address - 2, 1) != b'\x69':
+                    adhoc_bytes = read_bytes(adhoc_address, 64)
+                    if adhoc_bytes:
+                        with span('dialog.dump_adhoc_file'):
+                            dump_adhoc_file(adhoc_address, adhoc_bytes, prefetch)
+                        write_bytes(adhoc_address - 2, b'\x69')  # leave our mark to let us know we wrote this. nice.
+        else:
+            logger.info('Dynamic address found @ ' + str(hex(ja_address)))
+            try:
+                npc = read_string(npc_address)
+            except:
+                npc = ''
+            with span('dialog.sqlite_read'):
+                result = sqlite_read(ja_text, api_region, 'dialog')
+            if result is not None:
+                logger.info('Found database entry. No translation was needed.')
+                with span('dialog.write_bytes'):
+                    write_bytes(ja_address, result.encode() + b'\x00')
+            else:
+                logger.info('Translation is needed for ' + str(len(ja_text) / 3) + ' characters. Sending to ' + api_service)
+                with span('dialog.translate'):
+                    translated_text = sanitized_dialog_translate(api_service, api_pro, ja_text, api_key, api_region)
+                with span('dialog.sqlite_write'):
+                    sqlite_write(ja_text, 'dialog', translated_text, api_region, npc_name=npc)
+                with span('dialog.write_bytes'):
+                    write_bytes(ja_address, translated_text.encode() + b'\x00')
+
+        return ja_address, len(ja_text)
+    except AddressOutOfRange:
+        pass
+
+@out_of_process
+def load_evtx_hook(ecx_address: int, prefetch: bool):
+    '''
+    Dumps the EVTX file that was just loaded into memory.
+    ecx_address: Address where INDX starts
+    '''
+    indx_address = unpack_to_int(ecx_address)[0]
+    adhoc_bytes = read_bytes(indx_address, 64)
+    dump_adhoc_file(indx_address, adhoc_bytes, prefetch)
+
+    return indx_address, 0  # a whole file, not a line of text
+
+@out_of_process
+def quest_text_hook(
+    eax_address: int,
+    api_service: str,
+    api_key: str,
+    api_pro: str,
+    api_region: str):
+    '''
+    Translates the quest window.
+    eax_address: Where text can be modified to be fed to the screen
+    '''
+    logger = get_logger('out', 'out.log', 'quest')
+
+    quest_file = 'adhoc_wd_quests_requests'
+    quest_addr = unpack_to_int(eax_address)[0]
+
+    subquest_name_addr = quest_addr + 20
+    quest_name_addr = quest_addr + 76
+    quest_desc_addr = quest_addr + 132
+    quest_rewards_addr = quest_addr + 640
+    quest_repeat_rewards_addr = quest_addr + 744
+
+    subquest_name_ja = read_string(subquest_name_addr)
+    quest_name_ja = read_string(quest_name_addr)
+    quest_desc_ja = read_string(quest_desc_addr)
+    quest_rewards_ja = read_string(quest_rewards_addr)
+    quest_repeat_rewards_ja = read_string(quest_repeat_rewards_addr)
+
+    if not detect_lang(quest_desc_ja):
+        return quest_desc_addr, len(quest_desc_ja)
+
+    if subquest_name_ja:
+        subquest_name_en = query_string_from_file(subquest_name_ja, quest_file)
+        if subquest_name_en:
+            write_bytes(subquest_name_addr, str.encode(subquest_name_en) + b'\x00')
+    if quest_name_ja:
+        quest_name_en = query_string_from_file(quest_name_ja, quest_file)
+        if quest_name_en:
+            logger.info('Found quest address @ ' + str(hex(quest_name_addr)))
+            write_bytes(quest_name_addr, str.encode(quest_name_en) + b'\x00')
+    if quest_rewards_ja:
+        quest_rewards_en = clean_up_and_return_items(quest_rewards_ja)
+        if quest_rewards_en:
+            write_bytes(quest_rewards_addr, str.encode(quest_rewards_en) + b'\x00')
+    if quest_repeat_rewards_ja:
+        quest_repeat_rewards_en = clean_up_and_return_items(quest_repeat_rewards_ja)
+        if quest_repeat_rewards_en:
+            write_bytes(quest_repeat_rewards_addr, str.encode(quest_repeat_rewards_en) + b'\x00')
+    if quest_desc_ja:
+        with span('quest.translate'):
+            quest_desc_en = quest_translate(api_service, api_pro, quest_desc_ja, api_key, api_region)
+        if quest_desc_en:
+            write_bytes(quest_desc_addr, str.encode(quest_desc_en) + b'\x00')
+
+    return quest_desc_addr, len(quest_desc_ja)
+
+@out_of_process
+def walkthrough_hook(
+    esi_address: int,
+    api_service: str,
+    api_key: str,
+    api_pro: str,
+    api_region: str):
+    '''
+    Translates the walkthrough text.
+    esi_address: Where text can be modified to be fed to the screen
+    '''
+    logger = get_logger('out', 'out.log', 'walkthrough')
+
+    walkthrough_addr = unpack_to_int(esi_address)[0]
+    walkthrough_str = read_string(walkthrough_addr)
+
+    if detect_lang(walkthrough_str):
+        logger.debug('Walkthrough text: ' + str(walkthrough_str))
+        result = sqlite_read(walkthrough_str, api_region, 'walkthrough')
+
+        if result is not None:
+            logger.debug('Found database entry. No translation was needed.')
+            write_bytes(walkthrough_addr, result.encode() + b'\x00')
+        else:
+            logger.debug('Translation is needed for ' + str(len(walkthrough_str)) + ' characters. Sending to ' + api_service)
+            translated_text = sanitized_dialog_translate(api_service, api_pro, walkthrough_str, api_key, api_region, text_width=31)
+            sqlite_write(walkthrough_str, 'walkthrough', translated_text, api_region)
+            write_bytes(walkthrough_addr, translated_text.encode() + b'\x00')
+
+    return walkthrough_addr, len(walkthrough_str)
@@ -3,6 +3,7 @@ Python program used to translate various game UI elements for the game "Dragon Q
 '''
 
 from multiprocessing import Process
+import shutil
 import sys
 import time
 import click
@@ -15,9 +16,15 @@ from clarity import (translate,
     scan_for_adhoc_files,
     scan_for_overworld_names,
     scan_for_menu_ai_names,
-    scan_for_walkthrough
+    scan_for_walkthrough,
+    prefetch_translations,
+    build_translation_memories,
+    run_hook_server,
+    read_hook_events
 )
 from hook import activate_hooks
+from metrics import run_metrics_server
+from profiler import run_profiled, merge_profiles, PROFILE_DIRECTORY
 
 @click.command()
 @click.option('-v', '--debug', is_flag=True,
@@ -37,6 +44,10 @@ from hook import activate_hooks
                 help='''Scans for NPC names and changes them to their translated counterpart.''')
 @click.option('-u', '--disable-update-check', is_flag=True,
                 help='''Disables checking for updates on each launch.''')
+@click.option('--profile', is_flag=True,
+                help='''Samples the stacks of every clarity process and writes them to the
+                        profiles folder as flamegraph compatible folded stacks.
+                        Stop clarity with Ctrl+C to merge them into one file.''')
 
 def blast_off(update_weblate=False,
             disable_update_check=False,
@@ -44,7 +55,8 @@ def blast_off(update_weblate=False,
             cutscenes=False,
             player_names=False,
             npc_names=False,
-            debug=False
+            debug=False,
+            profile=False
 ):
     logging.basicConfig(
         format='%(message)s'
@@ -65,18 +77,47 @@ def blast_off(update_weblate=False,
 
     translate()
 
+    processes = []
+
+    def start_process(name, target, args=()):
+        if profile:
+            process = Process(name=name, target=run_profiled, args=(target, args))
+        else:
+            process = Process(name=name, target=target, args=args)
+        process.start()
+        processes.append(process)
+
+    if profile:
+        shutil.rmtree(PROFILE_DIRECTORY, ignore_errors=True)
+
     try:
+        start_process('Metrics server', run_metrics_server)
         if communication_window:
-            Process(name='Hook loader', target=activate_hooks, args=(debug,)).start()
-            Process(name='Walkthrough scanner', target=scan_for_walkthrough, args=()).start()
-        Process(name='Menu AI name scanner', target=scan_for_menu_ai_names, args=()).start()
-        Process(name='Overworld name scanner', target=scan_for_overworld_names, args=()).start()
-        Process(name='Adhoc scanner', target=scan_for_adhoc_files, args=()).start()
+            start_process('Translation memory builder', build_translation_memories)
+            start_process('Hook event reader', read_hook_events)
+            start_process('Hook server', run_hook_server)
+            start_process('Hook loader', activate_hooks, (debug,))
+            start_process('Walkthrough scanner', scan_for_walkthrough)
+            start_process('Translation prefetcher', prefetch_translations)
+        start_process('Menu AI name scanner', scan_for_menu_ai_names)
+        start_process('Overworld name scanner', scan_for_overworld_names)
+        start_process('Adhoc scanner', scan_for_adhoc_files)
     except WinAPIError:
         sys.exit(click.secho('Can\'t find DQX process. Exiting.', fg='red'))
 
     time.sleep(2)
     logging.warning('\nDone! Keep this window open (minimize it) and have fun on your adventure!')
 
+    if profile:
+        # the servers never exit on their own, so stop with ctrl+c. every process
+        # gets the interrupt and writes its stacks before exiting
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
+        logging.warning(f'Wrote merged profile to {merge_profiles()}')
+
 if __name__ == '__main__':
     blast_off()
@@ -14,6 +14,10 @@ from signatures import (
     foot_pattern,
     index_pattern
 )
+from metrics import counter, histogram
+
+PATTERN_SCAN_SECONDS = histogram('pattern_scan_seconds', 'Time spent scanning DQX\'s memory for a pattern.')
+BYTES_WRITTEN = counter('memory_bytes_written_total', 'Bytes written into DQX\'s memory.')
 
 def dqx_mem():
     '''
@@ -57,6 +61,7 @@ def write_bytes(address: int, value: bytes):
         PYM_PROCESS.write_bytes(address, value, size)
     except pymem.exception.MemoryWriteError:
         raise MemoryWriteError(address)
+    BYTES_WRITTEN.inc(size)
 
 def read_int(address: int):
     return PYM_PROCESS.read_int(address)
@@ -98,13 +103,14 @@ def pattern_scan(
     Returns:
         A list of results if return_multiple is True. Otherwise, one result.
     '''
-    if module:
-        module = pymem.process.module_from_name(PYM_PROCESS.process_handle, module)
-        found_addresses = _scan_entire_module(PYM_PROCESS.process_handle, module, pattern)
+    with PATTERN_SCAN_SECONDS.time(scope=module or 'all'):
+        if module:
+            module = pymem.process.module_from_name(PYM_PROCESS.process_handle, module)
+            found_addresses = _scan_entire_module(PYM_PROCESS.process_handle, module, pattern)
 
-    else:
-        found_addresses = _scan_all(
-            PYM_PROCESS.process_handle, pattern, return_multiple)
+        else:
+            found_addresses = _scan_all(
+                PYM_PROCESS.process_handle, pattern, return_multiple)
 
     if (found_length := len(found_addresses)) == 0:
         if return_multiple:
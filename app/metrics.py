@@ -0,0 +1,316 @@
+'''
+Counters and histograms for a running clarity session.
+
+Every clarity process (and the hooks inside DQX) keeps its own registry. Clarity's
+processes write a snapshot of it to metrics/ every few seconds from a background
+thread. The hooks can't run one, so they hand their snapshot to clarity's hook event
+reader through the hook event ring, which writes it out for them. The metrics server
+process reads the snapshots back, serves them in Prometheus text format on
+http://127.0.0.1:9099/metrics and logs a summary line once a minute.
+'''
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+from time import perf_counter
+import atexit
+import json
+import shutil
+import time
+from loguru import logger
+from common import atomic_write, in_game_process, process_file_name
+
+METRICS_DIRECTORY = 'metrics'
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9099
+
+# seconds between snapshots written by each process
+METRICS_EXPORT_INTERVAL = 10
+
+# seconds between summary lines in the console
+METRICS_SUMMARY_INTERVAL = 60
+
+# seconds. each bucket is 25% wider than the last, from 0.1ms to about a minute, so
+# percentiles estimated from the buckets are within a few percent
+DEFAULT_BUCKETS = tuple(round(0.0001 * 1.25 ** i, 7) for i in range(60))
+
+_registry = dict()
+_exporter = []  # the export thread, once the first metric is updated
+
+class Counter:
+    '''A value that only goes up, optionally split by labels.'''
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values = dict()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+        if not _exporter:
+            _start_exporter()
+
+    def snapshot(self) -> dict:
+        dic = dict()
+        dic['kind'] = self.kind
+        dic['description'] = self.description
+        dic['values'] = [[dict(key), value] for key, value in list(self.values.items())]
+
+        return dic
+
+class Histogram:
+    '''Counts observations into cumulative buckets, optionally split by labels.'''
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.values = dict()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0, 'max': 0.0}
+        bucket = bisect_left(self.buckets, value)
+        if bucket < len(self.buckets):
+            series['counts'][bucket] += 1
+        series['sum'] += value
+        series['count'] += 1
+        if value > series['max']:
+            series['max'] = value
+        if not _exporter:
+            _start_exporter()
+
+    @contextmanager
+    def time(self, **labels):
+        '''Observes how many seconds the enclosed block took.'''
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def series(self, **labels):
+        '''Returns the series for labels, or None if nothing was observed with them.'''
+        return self.values.get(tuple(sorted(labels.items())))
+
+    def summary(self, **labels) -> dict:
+        '''Returns the count, p50/p90/p99, max and mean (in seconds) of the series for labels.'''
+        return summarize_series(self.buckets, self.series(**labels))
+
+    def snapshot(self) -> dict:
+        dic = dict()
+        dic['kind'] = self.kind
+        dic['description'] = self.description
+        dic['buckets'] = list(self.buckets)
+        # copied, since the export thread takes snapshots while observe keeps running
+        dic['values'] = [[dict(key), {**series, 'counts': list(series['counts'])}] for key, series in list(self.values.items())]
+
+        return dic
+
+def quantile(buckets, counts: list, count: int, q: float):
+    '''
+    Estimates the q quantile of a histogram series the way Prometheus'
+    histogram_quantile does, by interpolating inside the bucket it falls in.
+    Quantiles above the last bucket come back as its bound.
+    '''
+    if not count:
+        return None
+    rank = q * count
+    cumulative = 0
+    for i, bucket_count in enumerate(counts):
+        if bucket_count and cumulative + bucket_count >= rank:
+            lower = buckets[i - 1] if i else 0.0
+            return lower + (buckets[i] - lower) * (rank - cumulative) / bucket_count
+        cumulative += bucket_count
+
+    return buckets[-1]
+
+def summarize_series(buckets, series) -> dict:
+    '''Returns the count, p50/p90/p99, max and mean (in seconds) of a histogram series (or None).'''
+    dic = dict()
+    count = series['count'] if series else 0
+    dic['count'] = count
+    for percent in (50, 90, 99):
+        estimate = quantile(buckets, series['counts'], count, percent / 100) if count else None
+        # the estimate can't be more than the largest value seen
+        dic[f'p{percent}'] = min(estimate, series['max']) if estimate is not None else None
+    dic['max'] = series['max'] if count else None
+    dic['mean'] = series['sum'] / count if count else None
+
+    return dic
+
+def counter(name: str, description: str) -> Counter:
+    '''Returns the counter called name, registering it on first use.'''
+    if name not in _registry:
+        _registry[name] = Counter(name, description)
+    return _registry[name]
+
+def histogram(name: str, description: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+    '''Returns the histogram called name, registering it on first use.'''
+    if name not in _registry:
+        _registry[name] = Histogram(name, description, buckets)
+    return _registry[name]
+
+def snapshot() -> dict:
+    '''Returns every metric registered in this process.'''
+    return {name: metric.snapshot() for name, metric in list(_registry.items())}
+
+def write_snapshot(name: str, metric_snapshots: dict, directory=METRICS_DIRECTORY):
+    '''Writes a snapshot to <directory>/<name>.json.'''
+    Path(directory).mkdir(exist_ok=True)
+    with atomic_write(Path(directory, name + '.json')) as f:  # so the server never reads half a snapshot
+        json.dump(metric_snapshots, f)
+
+def export_metrics(directory=METRICS_DIRECTORY):
+    '''Writes this process's snapshot to <directory>/<process name>_<pid>.json.'''
+    write_snapshot(process_file_name(), snapshot(), directory)
+
+def _start_exporter():
+    '''
+    Starts the thread that exports this process's snapshot every METRICS_EXPORT_INTERVAL
+    seconds and once more at exit. Inside DQX nothing is started, since a thread there
+    only runs while a hook holds the GIL. The hook runtime publishes its snapshot instead.
+    '''
+    _exporter.append(None)
+    if in_game_process():
+        return
+    thread = Thread(target=_export_periodically, name='MetricsExporter', daemon=True)
+    thread.start()
+    _exporter[0] = thread
+    atexit.register(_export_quietly)
+
+def _export_periodically():
+    while True:
+        time.sleep(METRICS_EXPORT_INTERVAL)
+        _export_quietly()
+
+def _export_quietly():
+    try:
+        export_metrics()
+    except OSError:
+        pass
+
+def read_snapshots(directory=METRICS_DIRECTORY) -> dict:
+    '''Returns the latest snapshot of every process, keyed by process.'''
+    snapshots = dict()
+    for path in sorted(Path(directory).glob('*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshots[path.stem] = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+    return snapshots
+
+def render_prometheus(snapshots: dict) -> str:
+    '''Renders snapshots in the Prometheus text exposition format.'''
+    metrics = dict()
+    for process, metric_snapshots in snapshots.items():
+        for name, metric in metric_snapshots.items():
+            metrics.setdefault(name, []).append((process, metric))
+
+    lines = []
+    for name in sorted(metrics):
+        first = metrics[name][0][1]
+        metric_name = 'clarity_' + name
+        lines.append(f"# HELP {metric_name} {first['description']}")
+        lines.append(f"# TYPE {metric_name} {first['kind']}")
+        for process, metric in metrics[name]:
+            for labels, value in metric['values']:
+                labels = {'process': process, **labels}
+                if metric['kind'] == 'counter':
+                    lines.append(f'{metric_name}{_format_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric['buckets'], value['counts']):
+                    cumulative += count
+                    lines.append(f"{metric_name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+                lines.append(f"{metric_name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {value['count']}")
+                lines.append(f"{metric_name}_sum{_format_labels(labels)} {value['sum']}")
+                lines.append(f"{metric_name}_count{_format_labels(labels)} {value['count']}")
+
+    return '\n'.join(lines) + '\n'
+
+def summary_line(snapshots: dict) -> str:
+    '''Returns a one line summary of the most useful totals across all processes.'''
+    def total(name, **labels):
+        result = 0
+        for metric_snapshots in snapshots.values():
+            metric = metric_snapshots.get(name)
+            if metric is None:
+                continue
+            for series_labels, value in metric['values']:
+                if all(series_labels.get(key) == wanted for key, wanted in labels.items()):
+                    result += value if metric['kind'] == 'counter' else value['count']
+        return result
+
+    database_hits = total('database_lookups_total', result='hit')
+    database_lookups = total('database_lookups_total')
+    hit_rate = f'{database_hits / database_lookups:.0%}' if database_lookups else '-'
+
+    return (
+        f"database hit rate {hit_rate} ({database_hits}/{database_lookups}), "
+        f"{total('translation_lookups_total', source='exact_memory') + total('translation_lookups_total', source='fuzzy_memory')} lines from translation memory, "
+        f"{total('translation_lookups_total', source='api')} lines sent to the API ({total('translation_characters_total')} characters), "
+        f"{total('adhoc_files_written_total')} adhoc files written, "
+        f"{total('names_rewritten_total')} names rewritten, "
+        f"hooks loaded {total('hooks_loaded_total')} / unloaded {total('hooks_unloaded_total')} times, "
+        f"{total('pattern_scan_seconds')} pattern scans"
+    )
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    '''Serves /metrics.'''
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus(read_snapshots(self.server.directory)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def run_metrics_server(directory=METRICS_DIRECTORY, host=METRICS_HOST, port=METRICS_PORT):
+    '''
+    Serves every process's metrics over HTTP, and periodically logs a summary line
+    and writes every process's stage traces (see tracing). Snapshots and traces left
+    over from a previous session are removed first.
+    '''
+    from tracing import write_traces, remove_traces  # tracing imports this module
+
+    shutil.rmtree(directory, ignore_errors=True)
+    Path(directory).mkdir(exist_ok=True)
+    remove_traces()
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        server.directory = directory
+        Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f'Serving metrics on http://{host}:{port}/metrics')
+    except OSError as e:
+        logger.warning(f'Could not serve metrics on port {port}. Only logging summaries.\nMessage: {e}')
+
+    while True:
+        time.sleep(METRICS_SUMMARY_INTERVAL)
+        snapshots = read_snapshots(directory)
+        logger.info('Stats: ' + summary_line(snapshots))
+        try:
+            write_traces(snapshots)
+        except OSError as e:
+            logger.debug(f'Could not write traces.\nMessage: {e}')
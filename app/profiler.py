@@ -0,0 +1,111 @@
+'''
+Sampling profiler for clarity's long running processes.
+
+A background thread looks at every other thread's stack a couple of hundred
+times a second and counts how often each stack was seen. The counts are written
+as folded stacks ("outer;inner;innermost count"), the format flamegraph.pl,
+speedscope and inferno read. Each process writes its own file to profiles/ and
+merge_profiles combines them into one, with the process name as the root frame.
+'''
+from collections import Counter
+from pathlib import Path
+from threading import Event, Thread, get_ident
+import re
+import sys
+from common import atomic_write, process_file_name
+
+PROFILE_DIRECTORY = 'profiles'
+MERGED_PROFILE = 'merged.folded'
+
+# seconds between samples
+SAMPLE_INTERVAL = 0.005
+
+# seconds between writing what's been sampled so far, in case the process gets killed
+PROFILE_WRITE_INTERVAL = 30
+
+class SamplingProfiler:
+    '''Samples the stacks of every thread in this process except its own.'''
+    def __init__(self, path: Path, interval=SAMPLE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, name='Sampling profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+    def _run(self):
+        own_thread = get_ident()
+        samples_per_write = max(1, int(PROFILE_WRITE_INTERVAL / self.interval))
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread:
+                    self.stacks[_fold(frame)] += 1
+            self.samples += 1
+            if self.samples % samples_per_write == 0:
+                self.write()
+
+    def write(self):
+        '''Writes the folded stacks sampled so far.'''
+        self.path.parent.mkdir(exist_ok=True)
+        with atomic_write(self.path) as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+def _fold(frame) -> str:
+    '''Returns a stack as "outer;inner;innermost", each frame as file:function.'''
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{Path(code.co_filename).stem}:{code.co_name}')
+        frame = frame.f_back
+    names.reverse()
+
+    return ';'.join(names).replace(' ', '_')
+
+def profile_path(directory=PROFILE_DIRECTORY) -> Path:
+    return Path(directory, process_file_name() + '.folded')
+
+def run_profiled(target, args=()):
+    '''
+    Runs target(*args) under the sampling profiler and writes its stacks when it
+    returns or exits. Used as the target of processes started with --profile.
+    '''
+    profiler = SamplingProfiler(profile_path())
+    profiler.start()
+    try:
+        target(*args)
+    finally:
+        profiler.stop()
+
+def merge_profiles(directory=PROFILE_DIRECTORY) -> Path:
+    '''
+    Merges every process's folded stacks into <directory>/merged.folded, rooting
+    each stack under the name of the process it came from.
+    '''
+    merged = Counter()
+    for path in sorted(Path(directory).glob('*.folded')):
+        if path.name == MERGED_PROFILE:
+            continue
+        process = re.sub(r'_\d+$', '', path.stem)
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    merged[f'{process};{stack}'] += int(count)
+
+    merged_path = Path(directory, MERGED_PROFILE)
+    with atomic_write(merged_path) as f:
+        for stack, count in merged.most_common():
+            f.write(f'{stack} {count}\n')
+
+    return merged_path
@@ -0,0 +1,207 @@
+'''
+Translation providers used to translate text that isn't in the database yet.
+
+Every provider translates batches of text and keeps track of how many characters
+it has sent and how long its requests take, so providers can be swapped or
+load tested without touching the hook shellcode.
+'''
+from abc import ABC, abstractmethod
+import hashlib
+import json
+import time
+import requests
+from metrics import counter, histogram
+
+REQUEST_SECONDS = histogram('translation_request_seconds', 'Time taken by requests to the translation service.')
+REQUEST_ERRORS = counter('translation_errors_total', 'Failed requests to the translation service.')
+
+class TranslationProvider(ABC):
+    '''
+    Base class for translation providers. Subclasses implement _translate_batch.
+    '''
+    name = ''
+    max_batch_size = 50
+
+    def __init__(self, api_key: str, is_pro: str, region_code: str):
+        self.api_key = api_key
+        self.is_pro = is_pro
+        self.region_code = region_code
+        self.request_count = 0
+        self.character_count = 0
+        self.error_count = 0
+
+    @abstractmethod
+    def _translate_batch(self, texts: list) -> list:
+        '''Translates one request's worth of texts. Returns the translations in the same order.'''
+
+    def translate(self, text: str) -> str:
+        '''Translates a single string.'''
+        return self.translate_batch([text])[0]
+
+    def translate_batch(self, texts: list) -> list:
+        '''
+        Translates a list of strings in as few requests as the service allows.
+        Returns the translations in the same order.
+        '''
+        translations = []
+        for i in range(0, len(texts), self.max_batch_size):
+            chunk = texts[i:i+self.max_batch_size]
+            start = time.perf_counter()
+            try:
+                translations += self._translate_batch(chunk)
+            except Exception:
+                self.error_count += 1
+                REQUEST_ERRORS.inc(provider=self.name)
+                raise
+            finally:
+                REQUEST_SECONDS.observe(time.perf_counter() - start, provider=self.name)
+
+            self.request_count += 1
+            self.character_count += sum(len(text) for text in chunk)
+
+        return translations
+
+    def usage(self) -> dict:
+        '''
+        Returns the number of characters sent this session. Providers that can ask
+        the service for the account's quota also fill in character_limit.
+        '''
+        dic = dict()
+        dic['character_count'] = self.character_count
+        dic['character_limit'] = None
+
+        return dic
+
+    def metrics(self) -> dict:
+        '''
+        Returns request counts and latency percentiles (in seconds). Latencies come
+        from the translation_request_seconds histogram, so they cover every provider
+        of this kind in the process.
+        '''
+        latency = REQUEST_SECONDS.summary(provider=self.name)
+        dic = dict()
+        dic['provider'] = self.name
+        dic['requests'] = self.request_count
+        dic['characters'] = self.character_count
+        dic['errors'] = self.error_count
+        dic['latency_p50'] = latency['p50']
+        dic['latency_p99'] = latency['p99']
+        dic['latency_max'] = latency['max']
+
+        return dic
+
+class DeepLProvider(TranslationProvider):
+    '''Uses DeepL Translate to translate text to the specified language.'''
+    name = 'deepl'
+
+    def _api_url(self) -> str:
+        if self.is_pro == 'True':
+            return 'https://api.deepl.com/v2'
+        return 'https://api-free.deepl.com/v2'
+
+    def _translate_batch(self, texts: list) -> list:
+        payload = [('auth_key', self.api_key), ('target_lang', self.region_code)]
+        payload += [('text', text) for text in texts]
+        r = requests.post(self._api_url() + '/translate', data=payload, timeout=5)
+        request_return = r.content
+        if r.status_code == 200:
+            return [item['text'] for item in json.loads(request_return)['translations']]
+        elif r.status_code == 403:
+            raise Exception('Your DeepL key is invalid. Make sure you entered it correctly.')
+        elif r.status_code == 456:
+            raise Exception('Your DeepL key has no remaining characters for the month. Try another key or wait until it resets.')
+        elif r.status_code in [408, 504]:
+            raise Exception('DeepL timed out making a translation request. This is not a Clarity issue. DeepL could be returning requests slower than usual, down or just unreachable.')
+        else:
+            error = json.loads(request_return)['message']
+            raise Exception(f'DeepL returned an error: {error}')
+
+    def usage(self) -> dict:
+        '''Asks DeepL how many characters are left on the key this month.'''
+        dic = super().usage()
+        r = requests.get(self._api_url() + '/usage', params={'auth_key': self.api_key}, timeout=5)
+        if r.status_code == 200:
+            account = json.loads(r.content)
+            dic['account_character_count'] = account['character_count']
+            dic['character_limit'] = account['character_limit']
+
+        return dic
+
+class GoogleProvider(TranslationProvider):
+    '''Uses Google Translate to translate text to the specified language.'''
+    name = 'google'
+    max_batch_size = 128
+
+    def _translate_batch(self, texts: list) -> list:
+        api_url = 'https://www.googleapis.com/language/translate/v2'
+        payload = [('source', 'ja'), ('target', self.region_code), ('format', 'text')]
+        payload += [('q', text) for text in texts]
+        r = requests.post(api_url, params={'key': self.api_key}, data=payload, timeout=5)
+        request_return = r.content
+        if r.status_code == 200:
+            return [item['translatedText'] for item in json.loads(request_return)['data']['translations']]
+        elif r.status_code == 400:
+            raise Exception('Your Google Translate API key is not valid. Check the key and try again.')
+        elif r.status_code == 408:
+            raise Exception('Google Translate timed out making a translation request. This is not a Clarity issue. Google Translate could be having issues. Try again later.')
+        else:
+            error = json.loads(request_return)['error']['message']
+            raise Exception(f'Google Translate returned an error: {error}')
+
+class LocalProvider(TranslationProvider):
+    '''
+    Offline stand-in that never leaves the machine. Returns a deterministic
+    pseudo-translation made of ascii words, roughly as long as a real translation
+    would be, so the whole dialog pipeline can be exercised without an API key.
+
+    latency: Seconds to sleep per request to simulate a network round trip
+    '''
+    name = 'local'
+    words = (
+        'the', 'hero', 'of', 'town', 'you', 'must', 'go', 'to', 'castle', 'and',
+        'find', 'a', 'slime', 'with', 'great', 'power', 'please', 'come', 'back', 'soon'
+    )
+
+    def __init__(self, api_key: str, is_pro: str, region_code: str, latency: float = 0.0):
+        super().__init__(api_key, is_pro, region_code)
+        self.latency = latency
+
+    def _translate_batch(self, texts: list) -> list:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.pseudo_translate(text) for text in texts]
+
+    def pseudo_translate(self, text: str) -> str:
+        '''Turns every two characters into a word picked by their hash.'''
+        characters = ''.join(text.split())
+        words = []
+        for i in range(0, len(characters), 2):
+            digest = hashlib.md5(characters[i:i+2].encode('utf-8')).digest()
+            words.append(self.words[digest[0] % len(self.words)])
+        if not words:
+            return text
+
+        return ' '.join(words).capitalize() + '.'
+
+PROVIDERS = {
+    'deepl': DeepLProvider,
+    'google': GoogleProvider,
+    'local': LocalProvider,
+}
+
+# providers are kept around so their usage and latency counters cover the whole session
+_provider_cache = dict()
+
+def get_provider(translation_service: str, is_pro: str, api_key: str, region_code: str) -> TranslationProvider:
+    '''
+    Returns the provider for translation_service, creating it on first use.
+    '''
+    cache_key = (translation_service, is_pro, api_key, region_code)
+    provider = _provider_cache.get(cache_key)
+    if provider is None:
+        if translation_service not in PROVIDERS:
+            raise Exception(f'Unknown translation service: {translation_service}')
+        provider = PROVIDERS[translation_service](api_key, is_pro, region_code)
+        _provider_cache[cache_key] = provider
+
+    return provider
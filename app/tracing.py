@@ -0,0 +1,118 @@
+'''
+Per stage latency tracing for the hooks and scanners.
+
+Wrap a stage in span('stage name') and its duration is recorded into the
+stage_seconds histogram (see metrics) for the current process. That's all that
+happens in the traced process. The metrics server writes the stage summaries of every
+process's metrics snapshot to traces/ as JSON and CSV once a minute, so p50/p99 per
+stage can be compared while clarity is running. Run this file to print a summary of everything in traces/.
+'''
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter_ns
+import csv
+import json
+import shutil
+import sys
+from common import atomic_write, process_file_name
+from metrics import histogram, summarize_series
+
+TRACE_DIRECTORY = 'traces'
+
+CSV_FIELDS = ['stage', 'count', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'mean_ms']
+
+STAGE_SECONDS = histogram('stage_seconds', 'Time spent in each traced stage of the hooks and scanners.')
+
+@contextmanager
+def span(stage: str):
+    '''
+    Times the enclosed block and records it under stage. The block's exceptions
+    are passed through and still recorded, since a failing stage can be a slow one.
+    '''
+    start = perf_counter_ns()
+    try:
+        yield
+    finally:
+        record(stage, perf_counter_ns() - start)
+
+def record(stage: str, duration_ns: int):
+    '''Records a timing for stage.'''
+    STAGE_SECONDS.observe(duration_ns / 1e9, stage=stage)
+
+def summary(metric_snapshots=None) -> dict:
+    '''
+    Returns the p50/p90/p99/max/mean of each stage in a process's metrics snapshot
+    (see metrics.snapshot). Defaults to the stages recorded in this process.
+    '''
+    if metric_snapshots is None:
+        metric_snapshots = {STAGE_SECONDS.name: STAGE_SECONDS.snapshot()}
+    metric = metric_snapshots.get(STAGE_SECONDS.name)
+    if metric is None:
+        return dict()
+
+    stages = dict()
+    for labels, series in sorted(metric['values'], key=lambda value: value[0]['stage']):
+        stages[labels['stage']] = _in_ms(summarize_series(metric['buckets'], series))
+
+    return stages
+
+def export_traces(directory=TRACE_DIRECTORY, name=None, stages=None) -> Path:
+    '''
+    Writes stage summaries to <directory>/<name>.json and .csv. name defaults to the
+    process name and pid and stages to this process's summary. Returns the JSON path.
+    '''
+    if name is None:
+        name = process_file_name()
+    if stages is None:
+        stages = summary()
+    Path(directory).mkdir(exist_ok=True)
+
+    json_path = Path(directory, name + '.json')
+    with atomic_write(json_path) as f:
+        json.dump(stages, f, indent=2)
+
+    with atomic_write(Path(directory, name + '.csv'), newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for stage, stats in stages.items():
+            writer.writerow({'stage': stage, **stats})
+
+    return json_path
+
+def write_traces(snapshots: dict, directory=TRACE_DIRECTORY):
+    '''
+    Writes the stage summaries of every process in snapshots (see metrics.read_snapshots).
+    Used by the metrics server, so the traced processes never write them themselves.
+    '''
+    for process, metric_snapshots in snapshots.items():
+        if STAGE_SECONDS.name in metric_snapshots:
+            export_traces(directory, process, summary(metric_snapshots))
+
+def remove_traces(directory=TRACE_DIRECTORY):
+    '''Removes the traces left over from a previous session.'''
+    shutil.rmtree(directory, ignore_errors=True)
+
+def _in_ms(stats: dict) -> dict:
+    '''Turns a histogram summary in seconds into the trace summary fields.'''
+    dic = dict()
+    dic['count'] = stats['count']
+    for field in ('p50', 'p90', 'p99', 'max', 'mean'):
+        dic[f'{field}_ms'] = round(stats[field] * 1000, 3) if stats[field] is not None else None
+
+    return dic
+
+def print_trace_summary(directory=TRACE_DIRECTORY):
+    '''Prints every exported stage summary in directory, one table per process.'''
+    for path in sorted(Path(directory).glob('*.json')):
+        with open(path, encoding='utf-8') as f:
+            stages = json.load(f)
+        print(path.stem)
+        print(f"  {'stage':<40} {'count':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for stage, stats in stages.items():
+            print(f"  {stage:<40} {stats['count']:>8} {_format_ms(stats['p50_ms'])} {_format_ms(stats['p99_ms'])} {_format_ms(stats['max_ms'])}")
+
+def _format_ms(value) -> str:
+    return f'{value:>9.3f}' if value is not None else f"{'-':>9}"
+
+if __name__ == '__main__':
+    print_trace_summary(sys.argv[1] if len(sys.argv) > 1 else TRACE_DIRECTORY)
@@ -1,5 +1,4 @@
 import textwrap
-import requests
 import json
 import sys
 import ctypes
@@ -9,128 +8,244 @@ from os.path import exists
 import langdetect
 import re
 import sqlite3
+from metrics import counter
+from providers import get_provider
+from translation_memory import (
+    translation_memory_lookup,
+    fuzzy_translation_lookup,
+    remember_translation,
+    is_english_region
+)
+
+TRANSLATION_LOOKUPS = counter('translation_lookups_total', 'Lines that weren\'t in the database, by where their translation came from.')
+TRANSLATION_CHARACTERS = counter('translation_characters_total', 'Characters sent to the translation service.')
+DATABASE_LOOKUPS = counter('database_lookups_total', 'Lookups against clarity_dialog.db, by table and result.')
 
+def translate(translation_service, is_pro, dialog_text, api_key, region_code):
+    '''Translates text with the provider configured in user_settings.ini.'''
+    provider = get_provider(translation_service, is_pro, api_key, region_code)
+    return provider.translate(dialog_text)
 
-def deepl_translate(dialog_text, is_pro, api_key, region_code):
-    '''Uses DeepL Translate to translate text to the specified language.'''
-    if is_pro == 'True':
-        api_url = 'https://api.deepl.com/v2/translate'
-    else:
-        api_url = 'https://api-free.deepl.com/v2/translate'
-    payload = {'auth_key': api_key, 'text': dialog_text, 'target_lang': region_code}
-    r = requests.post(api_url, data=payload, timeout=5)
-    request_return = r.content
-    if r.status_code == 200:
-        return json.loads(request_return)['translations'][0]['text']
-    elif r.status_code == 403:
-        raise Exception('Your DeepL key is invalid. Make sure you entered it correctly.')
-    elif r.status_code == 456:
-        raise Exception('Your DeepL key has no remaining characters for the month. Try another key or wait until it resets.')
-    elif r.status_code in [408, 504]:
-        raise Exception('DeepL timed out making a translation request. This is not a Clarity issue. DeepL could be returning requests slower than usual, down or just unreachable.')
-    else:
-        error = json.loads(request_return)['message']
-        raise Exception(f'DeepL returned an error: {error}')
-
-def google_translate(dialog_text, api_key, region_code):
-    '''Uses Google Translate to translate text to the specified language.'''
-    uri = '&source=ja&target=' + region_code + '&q=' + dialog_text + '&format=text'
-    api_url = 'https://www.googleapis.com/language/translate/v2?key=' + api_key + uri
-    headers = {'Content-Type': 'application/json'}
-    r = requests.post(api_url, headers=headers, timeout=5)
-    request_return = r.content
-    if r.status_code == 200:
-        return json.loads(request_return)['data']['translations'][0]['translatedText']
-    elif r.status_code == 400:
-        raise Exception('Your Google Translate API key is not valid. Check the key and try again.')
-    elif r.status_code == 408:
-        raise Exception('Google Translate timed out making a translation request. This is not a Clarity issue. Google Translate could be having issues. Try again later.')
-    else:
-        error = json.loads(request_return)['error']['message']
-        raise Exception(f'Google Translate returned an error: {error}')
+# tags seen in DQX dialog. ex: <br>, <center>, <select>, <pc>, <%nC_GOLD>
+DIALOG_TAG_PATTERN = re.compile(r'<.+?>')
+# text segments that still hold a tag spanning a new line are passed through untouched
+DIALOG_LOOSE_TAG_PATTERN = re.compile(r'<(.*?)>', re.DOTALL)
 
-def translate(translation_service, is_pro, dialog_text, api_key, region_code):
-    if translation_service == 'deepl':
-        return deepl_translate(dialog_text, is_pro, api_key, region_code)
-    elif translation_service == 'google':
-        return google_translate(dialog_text, api_key, region_code)
+TOKEN_TEXT = 'text'
+TOKEN_TAG = 'tag'
+TOKEN_BREAK = 'br'
+TOKEN_ALIGNMENT = 'alignment'
+
+# center and right aligned text doesn't work well in this game with ascii
+ALIGNMENT_TAGS = frozenset(['<center>', '<right>'])
+
+# lists don't have puncuation, so anything with these is treated as a sentence
+SENTENCE_PUNCTUATION = ('。', '？', '！')
+
+# full width spaces become ascii spaces, 「 creates a single double quote which looks weird
+# in english and elipsis doesn't look natural. romaji player names are prefixed with \x04,
+# which messes up the translation
+SENTENCE_PRE_TRANSLATE_TABLE = str.maketrans({'\n': ' ', '\u3000': ' ', '「': None, '…': None, '\x04': None})
+LIST_PRE_TRANSLATE_TABLE = str.maketrans({'\u3000': ' ', '「': None, '…': None})
+
+# translation sometimes comes back with a strange number of spaces
+TRIPLE_SPACE_PATTERN = re.compile('   ')
+DOUBLE_SPACE_PATTERN = re.compile('  ')
+
+# every third line gets a <br> to break the text up into dialog windows
+LINES_PER_WINDOW = 3
+MAX_WINDOW_LINES = 30
+
+SEGMENT_RAW = 'raw'
+SEGMENT_SENTENCE = 'sentence'
+SEGMENT_LIST = 'list'
+
+def tokenize_dialog(dialog_text: str) -> list:
+    '''
+    Splits DQX dialog into a list of (kind, value) tokens in a single pass.
+    kind is one of TOKEN_TEXT, TOKEN_TAG, TOKEN_BREAK or TOKEN_ALIGNMENT.
+    '''
+    tokens = []
+    position = 0
+    for match in DIALOG_TAG_PATTERN.finditer(dialog_text):
+        start, end = match.span()
+        if start > position:
+            tokens.append((TOKEN_TEXT, dialog_text[position:start]))
+        tag = match.group()
+        if tag == '<br>':
+            tokens.append((TOKEN_BREAK, tag))
+        elif tag in ALIGNMENT_TAGS:
+            tokens.append((TOKEN_ALIGNMENT, tag))
+        else:
+            tokens.append((TOKEN_TAG, tag))
+        position = end
+    if position < len(dialog_text):
+        tokens.append((TOKEN_TEXT, dialog_text[position:]))
+
+    return tokens
+
+def merge_breaks(tokens: list) -> list:
+    '''
+    Turns <br> tokens into spaces and joins them with the surrounding text.
+    We manage our own line breaks later.
+    '''
+    merged = []
+    for kind, value in tokens:
+        if kind == TOKEN_BREAK:
+            kind, value = TOKEN_TEXT, ' '
+        if kind == TOKEN_TEXT and merged and merged[-1][0] == TOKEN_TEXT:
+            merged[-1] = (TOKEN_TEXT, merged[-1][1] + value)
+        else:
+            merged.append((kind, value))
+
+    return merged
+
+def drop_alignment(tokens: list) -> list:
+    '''Removes alignment tags.'''
+    return [token for token in tokens if token[0] != TOKEN_ALIGNMENT]
+
+# token passes run in order before the text is split up into segments to translate
+DIALOG_TOKEN_PIPELINE = (merge_breaks, drop_alignment)
+
+def prepare_dialog_segments(dialog_text: str) -> list:
+    '''
+    Runs the dialog through the token pipeline and returns a list of (kind, value) segments.
+    SEGMENT_SENTENCE and SEGMENT_LIST values are sanitized text that needs translating,
+    SEGMENT_RAW values are written out as is.
+    '''
+    tokens = tokenize_dialog(dialog_text)
+    for token_pass in DIALOG_TOKEN_PIPELINE:
+        tokens = token_pass(tokens)
+
+    segments = []
+    for kind, value in tokens:
+        if kind != TOKEN_TEXT or value == '\n' or ('<' in value and DIALOG_LOOSE_TAG_PATTERN.search(value)):
+            segments.append((SEGMENT_RAW, value))
+        elif any(x in value for x in SENTENCE_PUNCTUATION):
+            # remove new lines before sending to translate
+            segments.append((SEGMENT_SENTENCE, value.translate(SENTENCE_PRE_TRANSLATE_TABLE) + '\n'))
+        else:
+            segments.append((SEGMENT_LIST, value.translate(LIST_PRE_TRANSLATE_TABLE)))
+
+    return segments
+
+def assemble_dialog(segments: list, translations: list, text_width=45, max_lines=None) -> str:
+    '''
+    Stitches translated segments back together with the raw tags, wrapping the text
+    and breaking it up into chunks to be fed into the in-game dialog window.
+
+    segments: Output of prepare_dialog_segments
+    translations: One translation for every segment that isn't SEGMENT_RAW, in order
+    '''
+    lines = _DialogLines()
+    translated = iter(translations)
+    for kind, value in segments:
+        if kind == SEGMENT_RAW:
+            lines.append(value)
+            continue
+
+        translation = next(translated)
+        if kind == SEGMENT_SENTENCE:
+            translation = translation.strip()
+            translation = TRIPLE_SPACE_PATTERN.sub(' ', translation)
+            translation = DOUBLE_SPACE_PATTERN.sub(' ', translation)
+            translation = textwrap.fill(translation, width=text_width, replace_whitespace=False, max_lines=max_lines)
+
+            # figure out where to put <br> to break up text
+            for count, line in enumerate(translation.split('\n'), start=1):
+                if count % LINES_PER_WINDOW == 0 and count <= MAX_WINDOW_LINES:
+                    lines.append(line + '\n<br>\n')
+                else:
+                    lines.append(line + '\n')
+        else:
+            lines.append(translation)
+
+        lines.clean()
+
+    return lines.text()
+
+class _DialogLines:
+    '''
+    Holds the dialog being built as a list of lines. Clean up passes only revisit
+    the lines that changed since the previous pass, so building a long cutscene
+    line stays linear.
+    '''
+    def __init__(self):
+        self.lines = ['']
+        self.dirty = 0  # lines before this index are already clean
+
+    def append(self, text: str):
+        parts = text.split('\n')
+        self.lines[-1] += parts[0]
+        self.lines.extend(parts[1:])
+
+    def clean(self):
+        '''
+        Removes blank lines and trailing whitespace. A <br> is added every few lines, but the
+        last window of dialog doesn't need one, so it's removed from the final line.
+        '''
+        tail = '\n'.join(self.lines[self.dirty:])
+        del self.lines[self.dirty:]
+        self.lines.extend(ll.rstrip() for ll in tail.splitlines() if ll.strip())
+        if self.lines and '<br>' in self.lines[-1]:
+            last_line = ''.join(self.lines.pop().rsplit('<br>', 1))
+            if last_line.strip():
+                self.lines.append(last_line.rstrip())
+        if not self.lines:
+            self.lines.append('')
+        self.dirty = len(self.lines) - 1
+
+    def text(self) -> str:
+        return '\n'.join(self.lines)
 
 def sanitized_dialog_translate(translation_service, is_pro, dialog_text, api_key, region_code, text_width=45, max_lines=None) -> str:
     '''
     Does a bunch of text sanitization to handle tags seen in DQX, as well as automatically
     splitting the text up into chunks to be fed into the in-game dialog window.
     '''
-    if detect_lang(dialog_text):
-        output = re.sub('<br>', ' ', dialog_text)
-        output = re.split(r'(<.+?>)', output)
-        final_string = ''
-        for item in output:
-            if item == '':
-                continue
-            if item == '<br>':  # we'll manage our own line breaks later
-                final_string += ' '
-                continue
-            alignment = ['<center>', '<right>']  # center and right aligned text doesn't work well in this game with ascii
-            if item in alignment:
-                final_string += ''
+    return sanitized_dialog_translate_batch(
+        translation_service, is_pro, [dialog_text], api_key, region_code, text_width=text_width, max_lines=max_lines
+    )[0]
+
+def sanitized_dialog_translate_batch(translation_service, is_pro, dialog_texts, api_key, region_code, text_width=45, max_lines=None) -> list:
+    '''
+    sanitized_dialog_translate for a list of lines. Everything that needs translating is
+    sent to the provider together, so a whole file only costs a handful of requests.
+    Returns the translations in the same order.
+    '''
+    results = list(dialog_texts)
+    pending = []
+    for index, dialog_text in enumerate(dialog_texts):
+        if not detect_lang(dialog_text):
+            continue
+
+        # the community may have already translated this line in the json files
+        if is_english_region(region_code):
+            if (existing_translation := translation_memory_lookup(dialog_text)) is not None:
+                results[index] = existing_translation
+                TRANSLATION_LOOKUPS.inc(source='exact_memory')
                 continue
-            if re.findall('<(.*?)>', item, re.DOTALL) or item == '\n':
-                final_string += item
-            else:
-                # lists don't have puncuation. remove new lines before sending to translate
-                puncs = ['。', '？', '！']
-                if any(x in item for x in puncs):
-                    sanitized = re.sub('\n', ' ', item) + '\n'
-                    sanitized = re.sub('\u3000', ' ', sanitized)  # replace full width spaces with ascii spaces
-                    sanitized = re.sub('「', '', sanitized)  # these create a single double quote, which look weird in english
-                    sanitized = re.sub('…', '', sanitized)  # elipsis doesn't look natural
-                    sanitized = re.sub('', '', sanitized)  # romaji player names use this. remove as it messes up the translation
-                    translation = translate(translation_service, is_pro, sanitized, api_key, region_code)
-                    translation = translation.strip()
-                    translation = re.sub('   ', ' ', translation)  # translation sometimes comes back with a strange number of spaces
-                    translation = re.sub('  ', ' ', translation)
-                    translation = textwrap.fill(translation, width=text_width, replace_whitespace=False, max_lines=max_lines)
-
-                    # figure out where to put <br> to break up text
-                    count = 1
-                    count_list = [3, 6, 9, 12, 15, 18, 21, 24, 27, 30]
-                    for line in translation.split('\n'):
-                        final_string += line
-                        if count in count_list:
-                            final_string += '\n<br>\n'
-                        else:
-                            final_string += '\n'
-                        count += 1
 
-                else:
-                    sanitized = item
-                    sanitized = re.sub('\u3000', ' ', sanitized)  # replace full width spaces with ascii spaces
-                    sanitized = re.sub('「', '', sanitized)  # these create a single double quote, which look weird in english
-                    sanitized = re.sub('…', '', sanitized)  # elipsis doesn't look natural with english
-                    translation = translate(translation_service, is_pro, sanitized, api_key, region_code)
-                    final_string += translation
-
-                def rreplace(s, old, new, occurrence):
-                    li = s.rsplit(old, occurrence)
-                    return new.join(li)
-
-                # this cleans up any blank newlines
-                final_string = "\n".join([ll.rstrip() for ll in final_string.splitlines() if ll.strip()])        
-
-                # the above code adds a line break every 3 lines, but doesn't account for the last section
-                # of dialog that doesn't need a <br> if it's just one window of dialog, so remove it
-                final_string_count = final_string.count('\n')
-                count = 0
-                for line in final_string.split('\n'):
-                    if count == final_string_count:
-                        if '<br>' in line:
-                            final_string = rreplace(final_string, '<br>', '', 1)
-                            final_string = '\n'.join([ll.rstrip() for ll in final_string.splitlines() if ll.strip()])
-                    count += 1
-                
-        return final_string
-    else:
-        return dialog_text
+        # or we've seen a line that only differs by a name, a number or punctuation
+        if (existing_translation := fuzzy_translation_lookup(dialog_text, region_code)) is not None:
+            results[index] = existing_translation
+            TRANSLATION_LOOKUPS.inc(source='fuzzy_memory')
+            continue
+
+        pending.append((index, prepare_dialog_segments(dialog_text)))
+
+    texts = [value for index, segments in pending for kind, value in segments if kind != SEGMENT_RAW]
+    if pending:
+        TRANSLATION_LOOKUPS.inc(len(pending), source='api')
+        TRANSLATION_CHARACTERS.inc(sum(len(text) for text in texts), service=translation_service)
+    provider = get_provider(translation_service, is_pro, api_key, region_code)
+    translations = iter(provider.translate_batch(texts))
+    for index, segments in pending:
+        segment_translations = [next(translations) for kind, value in segments if kind != SEGMENT_RAW]
+        results[index] = assemble_dialog(segments, segment_translations, text_width=text_width, max_lines=max_lines)
+        remember_translation(dialog_texts[index], results[index], region_code)
+
+    return results
 
 def quest_translate(translation_service, is_pro, quest_text, api_key, region):
     '''
@@ -140,7 +255,14 @@ def quest_translate(translation_service, is_pro, quest_text, api_key, region):
     if db_quest_text:
         return db_quest_text
 
+    if is_english_region(region):
+        if (existing_translation := translation_memory_lookup(quest_text)) is not None:
+            TRANSLATION_LOOKUPS.inc(source='exact_memory')
+            return existing_translation
+
     full_text = re.sub('\n', ' ', quest_text)
+    TRANSLATION_LOOKUPS.inc(source='api')
+    TRANSLATION_CHARACTERS.inc(len(full_text), service=translation_service)
     translation = translate(translation_service, is_pro, full_text, api_key, region)
     if translation:
         formatted_translation = textwrap.fill(translation, width=45, replace_whitespace=False)
@@ -160,8 +282,10 @@ def sqlite_read(text_to_query, language, table):
         results = cursor.fetchone()
 
         if results is not None:
+            DATABASE_LOOKUPS.inc(table=table, result='hit')
             return results[0].replace("''", "'")
         else:
+            DATABASE_LOOKUPS.inc(table=table, result='miss')
             return None
 
     except sqlite3.Error as e:
@@ -201,6 +325,46 @@ def sqlite_write(source_text, table, translated_text, language, npc_name=''):
         if conn:
             conn.close()
 
+def queue_prefetch(lines: list, file: str):
+    '''
+    Queues lines from a newly seen game file to be translated in the background.
+    Lines already queued are ignored.
+    '''
+    try:
+        conn = sqlite3.connect('clarity_dialog.db')
+        conn.execute('CREATE TABLE IF NOT EXISTS prefetch_queue (ja TEXT PRIMARY KEY, file TEXT)')
+        conn.executemany('INSERT OR IGNORE INTO prefetch_queue (ja, file) VALUES (?, ?)', [(line, file) for line in lines])
+        conn.commit()
+    except sqlite3.Error as e:
+        raise Exception(f'Unable to queue lines for prefetch: {e}')
+    finally:
+        if conn:
+            conn.close()
+
+def read_prefetch_queue(limit: int) -> list:
+    '''Returns up to limit lines waiting to be prefetched.'''
+    try:
+        conn = sqlite3.connect('clarity_dialog.db')
+        conn.execute('CREATE TABLE IF NOT EXISTS prefetch_queue (ja TEXT PRIMARY KEY, file TEXT)')
+        return [row[0] for row in conn.execute('SELECT ja FROM prefetch_queue LIMIT ?', (limit,))]
+    except sqlite3.Error as e:
+        raise Exception(f'Failed to query prefetch_queue: {e}')
+    finally:
+        if conn:
+            conn.close()
+
+def remove_from_prefetch_queue(lines: list):
+    '''Removes lines that have been prefetched.'''
+    try:
+        conn = sqlite3.connect('clarity_dialog.db')
+        conn.executemany('DELETE FROM prefetch_queue WHERE ja = ?', [(line,) for line in lines])
+        conn.commit()
+    except sqlite3.Error as e:
+        raise Exception(f'Unable to remove lines from prefetch_queue: {e}')
+    finally:
+        if conn:
+            conn.close()
+
 def determine_translation_service():
     '''Parses the user config file to get information needed to make translation calls.'''
     filename = 'user_settings.ini'
@@ -211,14 +375,20 @@ def determine_translation_service():
                                 'DeepLTranslateKey': 'null',
                                 'EnableGoogleTranslate': 'False',
                                 'GoogleTranslateKey': 'null',
+                                'EnableLocalTranslate': 'False',
                                 'RegionCode': 'EN'
                                 }
         config['behavior'] = {}
         config['behavior']['EnableDialogLogging'] = 'False'
+        config['behavior']['EnablePrefetch'] = 'False'
+        config['behavior']['EnableHookServer'] = 'False'
         with open(filename, 'w') as configfile:
             config.write(configfile)
 
     config.read(filename)
+    local_translate_choice = 'False'  # offline stand-in for testing. older config files won't have this
+    enable_prefetch = 'False'
+    enable_hook_server = 'False'
     if 'translation' in config:
         if 'EnableDeepLTranslate' in config['translation']:
             deepl_translate_choice = config['translation']['EnableDeepLTranslate']
@@ -230,17 +400,23 @@ def determine_translation_service():
             google_translate_choice = config['translation']['EnableGoogleTranslate']
         if 'GoogleTranslateKey' in config['translation']:
             google_translate_key = config['translation']['GoogleTranslateKey']
+        if 'EnableLocalTranslate' in config['translation']:
+            local_translate_choice = config['translation']['EnableLocalTranslate']
         if 'RegionCode' in config['translation']:
             region_code = config['translation']['RegionCode']
     if 'behavior' in config:
         if 'EnableDialogLogging' in config['behavior']:
             enable_dialog_logging = config['behavior']['EnableDialogLogging']
+        if 'EnablePrefetch' in config['behavior']:
+            enable_prefetch = config['behavior']['EnablePrefetch']
+        if 'EnableHookServer' in config['behavior']:
+            enable_hook_server = config['behavior']['EnableHookServer']
 
-    if (deepl_translate_choice == 'False' and google_translate_choice == 'False'):
+    if (deepl_translate_choice == 'False' and google_translate_choice == 'False' and local_translate_choice == 'False'):
         ctypes.windll.user32.MessageBoxW(0, f"You need to enable a translation service in user_settings.ini. Open the file in Notepad and set it up.\n\nCurrent values:\n\nEnableDeepLTranslate: {config['translation']['EnableDeepLTranslate']}\nEnableGoogleTranslate: {config['translation']['EnableGoogleTranslate']}", "[dqxclarity] No translation service enabled", 0x10)
         sys.exit()
 
-    if (deepl_translate_choice == 'True' and google_translate_choice == 'True'):
+    if [deepl_translate_choice, google_translate_choice, local_translate_choice].count('True') > 1:
         ctypes.windll.user32.MessageBoxW(0, f"Only enable one translation service in user_settings.ini. Open the file in Notepad and set it up.\n\nCurrent values:\n\nEnableDeepLTranslate: {config['translation']['EnableDeepLTranslate']}\nEnableGoogleTranslate: {config['translation']['EnableGoogleTranslate']}", "[dqxclarity] Too many translation serviced enabled", 0x10)
         sys.exit()
         
@@ -252,7 +428,11 @@ def determine_translation_service():
         ctypes.windll.user32.MessageBoxW(0, f"Invalid value detected for EnableGoogleTranslate. Open user_settings.ini in Notepad and fix it.\n\nValid values are: True, False\n\nCurrent values:\n\nEnableGoogleTranslate: {config['translation']['EnableGoogleTranslate']}", "[dqxclarity] Misconfigured boolean", 0x10)
         sys.exit()
         
-    if (deepl_translate_key == 'null' and google_translate_key == 'null'):
+    if (local_translate_choice != 'True' and local_translate_choice != 'False'):
+        ctypes.windll.user32.MessageBoxW(0, f"Invalid value detected for EnableLocalTranslate. Open user_settings.ini in Notepad and fix it.\n\nValid values are: True, False\n\nCurrent values:\n\nEnableLocalTranslate: {config['translation']['EnableLocalTranslate']}", "[dqxclarity] Misconfigured boolean", 0x10)
+        sys.exit()
+
+    if (deepl_translate_key == 'null' and google_translate_key == 'null' and local_translate_choice == 'False'):
         ctypes.windll.user32.MessageBoxW(0, f"You need to configure an API key in user_settings.ini. Open the file in Notepad and set it up.\n\nCurrent values:\n\nDeepLTranslateKey: {config['translation']['DeepLTranslateKey']}\nGoogleTranslateKey: {config['translation']['GoogleTranslateKey']}", "[dqxclarity] No API key configured", 0x10)
         sys.exit()
         
@@ -264,6 +444,14 @@ def determine_translation_service():
         ctypes.windll.user32.MessageBoxW(0, f"Invalid value detected for EnableDialogLogging. Open user_settings.ini in Notepad and fix it.\n\nValid values are: True, False\n\nCurrent values:\n\nEnableDialogLogging: {config['translation']['EnableDialogLogging']}", "[dqxclarity] Misconfigured boolean", 0x10)
         sys.exit()
 
+    if (enable_prefetch != 'True' and enable_prefetch != 'False'):
+        ctypes.windll.user32.MessageBoxW(0, f"Invalid value detected for EnablePrefetch. Open user_settings.ini in Notepad and fix it.\n\nValid values are: True, False\n\nCurrent values:\n\nEnablePrefetch: {config['behavior']['EnablePrefetch']}", "[dqxclarity] Misconfigured boolean", 0x10)
+        sys.exit()
+
+    if (enable_hook_server != 'True' and enable_hook_server != 'False'):
+        ctypes.windll.user32.MessageBoxW(0, f"Invalid value detected for EnableHookServer. Open user_settings.ini in Notepad and fix it.\n\nValid values are: True, False\n\nCurrent values:\n\nEnableHookServer: {config['behavior']['EnableHookServer']}", "[dqxclarity] Misconfigured boolean", 0x10)
+        sys.exit()
+
     dic = dict()
     if deepl_translate_choice == 'True':
         dic['TranslateService'] = 'deepl'
@@ -273,8 +461,14 @@ def determine_translation_service():
         dic['TranslateService'] = 'google'
         dic['TranslateKey'] = google_translate_key
         dic['IsPro'] = 'False'
+    elif local_translate_choice == 'True':
+        dic['TranslateService'] = 'local'
+        dic['TranslateKey'] = 'null'
+        dic['IsPro'] = 'False'
         
     dic['EnableDialogLogging'] = enable_dialog_logging
+    dic['EnablePrefetch'] = enable_prefetch
+    dic['EnableHookServer'] = enable_hook_server
     dic['RegionCode'] = region_code
 
     return dic
@@ -0,0 +1,451 @@
+'''
+Translation memory built from the curated json/_lang/en files.
+
+A lot of dynamic dialog, quest names and items already have a community
+translation in the json files. These are looked up here before anything is
+sent to a paid translation service.
+
+The memories are built by clarity's translation memory builder process and
+saved to corpus_cache/. Clarity's processes (the hook server's workers and the
+prefetcher) load the saved copy. Inside DQX they aren't used at all: loading them
+would stall the game thread and they take over 100MB in its 32 bit process, so
+lines there go straight to the database and the translation service.
+'''
+from pathlib import Path
+import os
+import pickle
+import random
+import re
+import sqlite3
+import time
+import unicodedata
+import zlib
+from os.path import exists
+from common import atomic_write, in_game_process
+from corpus import load_corpus, CORPUS_CACHE_DIRECTORY
+
+JSON_LANG_PATH = 'json/_lang/en'
+
+# json files store the game's new lines as | and tabs as \t
+JSON_NEWLINE = '|'
+JSON_TAB = '\\t'
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# tags like <pc> or <%nC_GOLD>, numbers and full width roman numerals (Ⅰ to Ⅻ) can change
+# between otherwise identical lines. NFKC turns Ⅱ into II, which can't be told apart from
+# ordinary capitals, so the numerals are swapped for private use characters before normalizing
+ROMAN_NUMERALS = ''.join(chr(code) for code in range(0x2160, 0x216C))
+ROMAN_NUMERAL_MARKS = ''.join(chr(code) for code in range(0xE000, 0xE00C))
+ROMAN_NUMERAL_TABLE = str.maketrans(ROMAN_NUMERALS, ROMAN_NUMERAL_MARKS)
+ROMAN_NUMERAL_VALUES = {mark: unicodedata.normalize('NFKC', numeral) for mark, numeral in zip(ROMAN_NUMERAL_MARKS, ROMAN_NUMERALS)}
+PLACEHOLDER_PATTERN = re.compile(f'<[^<>]+>|\\d+|[{ROMAN_NUMERAL_MARKS}]')
+PLACEHOLDER_MARK = '\x00'
+# punctuation is ignored when comparing lines. checked after NFKC, so full width forms are covered
+PUNCTUATION_TABLE = str.maketrans('', '', '。、.,!?…「」『』・~ー―')
+
+# minimum jaccard similarity of character trigrams for a fuzzy match
+FUZZY_THRESHOLD = 0.9
+# short lines like item names change meaning with a single character, so they need an exact masked match
+FUZZY_MIN_LENGTH = 20
+# lsh settings. signatures use one permutation hashing into FUZZY_BINS bins,
+# grouped into bands of FUZZY_ROWS bins
+FUZZY_BINS = 8
+FUZZY_ROWS = 2
+FUZZY_MAX_CANDIDATES = 200
+_EMPTY_BIN = (1 << 61) - 1
+
+MEMORY_CACHE_VERSION = 1
+# how often a saved memory is checked for a newer copy
+MEMORY_CHECK_INTERVAL = 30
+
+_in_game = in_game_process()
+
+def normalize_text(text: str) -> str:
+    '''
+    Folds full width characters into their ascii counterparts (NFKC) and removes
+    all whitespace, so lines that only differ by spacing or width match.
+    '''
+    return WHITESPACE_PATTERN.sub('', unicodedata.normalize('NFKC', text))
+
+def from_json_string(text: str) -> str:
+    '''Converts a string from the json files into the text the game has in memory.'''
+    return text.replace(JSON_NEWLINE, '\n').replace(JSON_TAB, '\t')
+
+class TranslationMemory:
+    '''
+    Maps Japanese text to an existing English translation.
+
+    Lines are indexed by their normalized form. Exact matches always win, so a
+    line is only stored separately when another line with the same normalized
+    form has a different translation.
+    '''
+    def __init__(self):
+        self.normalized = dict()
+        self.exact = dict()
+        self._normalized_source = dict()  # crc of the line that claimed each normalized form
+
+    def add(self, ja: str, en: str):
+        key = normalize_text(ja)
+        source = zlib.crc32(ja.encode('utf-8'))  # not hash(), which changes between processes
+        if key not in self.normalized:
+            self.normalized[key] = en
+            self._normalized_source[key] = source
+        elif self._normalized_source[key] != source and self.normalized[key] != en:
+            self.exact.setdefault(ja, en)
+
+    def lookup(self, ja: str):
+        '''Returns the stored translation or None.'''
+        if ja in self.exact:
+            return self.exact[ja]
+        return self.normalized.get(normalize_text(ja))
+
+    def __len__(self):
+        return len(self.normalized) + len(self.exact)
+
+def iter_json_translations(path: str = JSON_LANG_PATH):
+    '''
+    Yields (ja, en) for every entry in the json files in path that has a translation.
+    Strings are converted to the text the game has in memory. Files are read with
+    the corpus loader, so only the ones that changed since the last run are parsed.
+    '''
+    for corpus_file in load_corpus(path).values():
+        # a broken file has no entries, so it doesn't take the rest of the memory with it
+        for ja, en in zip(corpus_file.ja, corpus_file.en):
+            if not en or ja.startswith(('clarity_nt_char', 'clarity_ms_space')):
+                continue
+            yield from_json_string(ja), from_json_string(en)
+
+def build_translation_memory(path: str = JSON_LANG_PATH) -> TranslationMemory:
+    '''
+    Reads every json file in path and indexes each entry that has a translation.
+    '''
+    memory = TranslationMemory()
+    for ja, en in iter_json_translations(path):
+        memory.add(ja, en)
+
+    return memory
+
+def memory_cache_path(name: str) -> Path:
+    return Path(CORPUS_CACHE_DIRECTORY, f'{name}_memory.pickle')
+
+def save_memory(memory, name: str):
+    '''Saves a built memory to corpus_cache/ for SavedMemory to load.'''
+    path = memory_cache_path(name)
+    path.parent.mkdir(exist_ok=True)
+    with atomic_write(path, 'wb') as f:
+        pickle.dump({'version': MEMORY_CACHE_VERSION, 'memory': memory}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+class SavedMemory:
+    '''
+    A memory saved by save_memory. It's loaded on first use and loaded again when a
+    newer copy is saved, checking the file at most every MEMORY_CHECK_INTERVAL
+    seconds. get returns None until a copy has been saved.
+    '''
+    def __init__(self, name: str):
+        self.path = memory_cache_path(name)
+        self.memory = None
+        self.stamp = None
+        self.next_check = 0
+
+    def get(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return self.memory
+        self.next_check = now + MEMORY_CHECK_INTERVAL
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return self.memory
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        if stamp != self.stamp:
+            try:
+                with open(self.path, 'rb') as f:
+                    data = pickle.load(f)
+            except Exception:
+                return self.memory  # being replaced or from another version. try again later
+            if isinstance(data, dict) and data.get('version') == MEMORY_CACHE_VERSION:
+                self.memory = data['memory']
+            self.stamp = stamp
+
+        return self.memory
+
+_translation_memory = SavedMemory('translation')
+
+def get_translation_memory():
+    '''Returns the saved translation memory, or None if it hasn't been built yet or this is DQX.'''
+    if _in_game:
+        return None
+    return _translation_memory.get()
+
+def translation_memory_lookup(text: str):
+    '''
+    Returns the existing translation for text from the json files or None.
+    '''
+    if (memory := get_translation_memory()) is not None:
+        return memory.lookup(text)
+
+def mask_placeholders(text: str) -> tuple:
+    '''
+    Returns the normalized text with placeholders replaced by a marker and
+    punctuation removed, along with the placeholders in the order they appeared.
+    '''
+    normalized = normalize_text(text.translate(ROMAN_NUMERAL_TABLE))
+    placeholders = tuple(ROMAN_NUMERAL_VALUES.get(found, found) for found in PLACEHOLDER_PATTERN.findall(normalized))
+    masked = PLACEHOLDER_PATTERN.sub(PLACEHOLDER_MARK, normalized).translate(PUNCTUATION_TABLE)
+
+    return masked, placeholders
+
+def substitute_placeholders(translation: str, source_placeholders: tuple, target_placeholders: tuple):
+    '''
+    Swaps the placeholders of a stored line for the ones in the line being translated.
+    Returns None if the translation can't be safely rewritten.
+    '''
+    if source_placeholders == target_placeholders:
+        return translation
+    if len(source_placeholders) != len(target_placeholders):
+        return None
+
+    mapping = dict()
+    unchanged = set()
+    for source, target in zip(source_placeholders, target_placeholders):
+        if source == target:
+            unchanged.add(source)
+        elif mapping.setdefault(source, target) != target:
+            return None
+    if unchanged.intersection(mapping):
+        return None
+
+    # each placeholder has to be in the translation as often as it's in the Japanese.
+    # ex: a number that was spelled out, or "I" the numeral next to "I" the word
+    for source in mapping:
+        if len(re.findall(_token_pattern(source), translation)) != source_placeholders.count(source):
+            return None
+
+    tokens = re.compile('|'.join(_token_pattern(source) for source in sorted(mapping, key=len, reverse=True)))
+    return tokens.sub(lambda match: mapping[match.group()], translation)
+
+def _token_pattern(token: str) -> str:
+    '''Pattern that only matches token as a whole word. Tags are matched as they are.'''
+    pattern = re.escape(token)
+    if token[0].isalnum():
+        pattern = r'\b' + pattern
+    if token[-1].isalnum():
+        pattern += r'\b'
+    return pattern
+
+def _trigrams(masked: str) -> set:
+    if len(masked) < 3:
+        return {masked}
+    return {masked[i:i+3] for i in range(len(masked) - 2)}
+
+def _signature(trigrams: set) -> list:
+    '''One permutation minhash. Empty bins borrow from their neighbour so short lines still band.'''
+    bins = [_EMPTY_BIN] * FUZZY_BINS
+    for trigram in trigrams:
+        value = zlib.crc32(trigram.encode('utf-8'))  # saved indexes are read by other processes, so no hash()
+        position = value % FUZZY_BINS
+        value //= FUZZY_BINS
+        if value < bins[position]:
+            bins[position] = value
+    for position in range(FUZZY_BINS):
+        if bins[position] == _EMPTY_BIN:
+            for offset in range(1, FUZZY_BINS):
+                neighbour = bins[(position + offset) % FUZZY_BINS]
+                if neighbour != _EMPTY_BIN:
+                    bins[position] = neighbour + offset
+                    break
+
+    return bins
+
+def _band_keys(signature: list) -> list:
+    # hashes of int tuples are the same in every process, so saved buckets stay valid
+    return [hash((band,) + tuple(signature[band:band+FUZZY_ROWS])) for band in range(0, FUZZY_BINS, FUZZY_ROWS)]
+
+class FuzzyTranslationMemory:
+    '''
+    Finds stored lines that only differ from a new line by numbers, name placeholders,
+    punctuation or a few characters, and reuses their translation.
+
+    Lines are compared on their masked form (see mask_placeholders). Identical masked
+    forms are looked up directly, anything else goes through a minhash lsh index of
+    character trigrams and is accepted if the jaccard similarity reaches threshold.
+    '''
+    def __init__(self, threshold: float = FUZZY_THRESHOLD):
+        self.threshold = threshold
+        self.masked = []
+        self.placeholders = []
+        self.translations = []
+        self.by_masked = dict()
+        self.buckets = dict()
+
+    def add(self, ja: str, en: str):
+        masked, placeholders = mask_placeholders(ja)
+        if masked in self.by_masked:
+            return
+        entry = len(self.masked)
+        self.masked.append(masked)
+        self.placeholders.append(placeholders)
+        self.translations.append(en)
+        self.by_masked[masked] = entry
+
+        for key in _band_keys(_signature(_trigrams(masked))):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                self.buckets[key] = entry
+            elif isinstance(bucket, int):
+                self.buckets[key] = [bucket, entry]
+            else:
+                bucket.append(entry)
+
+    def match(self, ja: str):
+        '''
+        Returns (translation, similarity) for the best stored line or None.
+        '''
+        masked, placeholders = mask_placeholders(ja)
+        entry = self.by_masked.get(masked)
+        if entry is not None:
+            translation = substitute_placeholders(self.translations[entry], self.placeholders[entry], placeholders)
+            if translation is not None:
+                return translation, 1.0
+
+        if len(masked) < FUZZY_MIN_LENGTH:
+            return None
+
+        trigrams = _trigrams(masked)
+        candidates = set()
+        for key in _band_keys(_signature(trigrams)):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                continue
+            if isinstance(bucket, int):
+                candidates.add(bucket)
+            else:
+                candidates.update(bucket[:FUZZY_MAX_CANDIDATES])
+
+        best = None
+        best_similarity = self.threshold
+        for candidate in candidates:
+            candidate_trigrams = _trigrams(self.masked[candidate])
+            smaller, larger = sorted((len(trigrams), len(candidate_trigrams)))
+            if smaller < larger * best_similarity:
+                continue  # can't reach the threshold whatever the overlap
+            overlap = len(trigrams & candidate_trigrams)
+            similarity = overlap / (len(trigrams) + len(candidate_trigrams) - overlap)
+            if similarity >= best_similarity:
+                translation = substitute_placeholders(self.translations[candidate], self.placeholders[candidate], placeholders)
+                if translation is not None:
+                    best = (translation, similarity)
+                    best_similarity = similarity
+
+        return best
+
+    def lookup(self, ja: str):
+        '''Returns a translation from a near duplicate line or None.'''
+        if result := self.match(ja):
+            return result[0]
+
+    def __len__(self):
+        return len(self.masked)
+
+def is_english_region(region_code: str) -> bool:
+    '''The json files are in English, so they're only used for English regions.'''
+    return region_code.upper().startswith('EN')
+
+def build_fuzzy_translation_memory(region_code: str, path: str = JSON_LANG_PATH, database: str = 'clarity_dialog.db') -> FuzzyTranslationMemory:
+    '''
+    Indexes the translations cached in the dialog table and, for English, the json files.
+    '''
+    memory = FuzzyTranslationMemory()
+    if exists(database):
+        try:
+            conn = sqlite3.connect(database)
+            try:
+                for ja, translation in conn.execute(f'SELECT ja, {region_code} FROM dialog WHERE {region_code} IS NOT NULL'):
+                    if ja and translation:
+                        memory.add(ja, translation)
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass  # no dialog table yet. the json files still help
+
+    if is_english_region(region_code):
+        for ja, en in iter_json_translations(path):
+            memory.add(ja, en)
+
+    return memory
+
+_fuzzy_translation_memories = dict()
+
+def get_fuzzy_translation_memory(region_code: str):
+    '''Returns the saved fuzzy translation memory for a region, or None if it hasn't been built yet or this is DQX.'''
+    if _in_game:
+        return None
+    if region_code not in _fuzzy_translation_memories:
+        _fuzzy_translation_memories[region_code] = SavedMemory(f'fuzzy_{region_code.lower()}')
+
+    return _fuzzy_translation_memories[region_code].get()
+
+def fuzzy_translation_lookup(text: str, region_code: str):
+    '''
+    Returns a translation reused from a near duplicate line or None.
+    '''
+    if (memory := get_fuzzy_translation_memory(region_code)) is not None:
+        return memory.lookup(text)
+
+def remember_translation(text: str, translation: str, region_code: str):
+    '''Adds a fresh translation to the fuzzy memory if it has been loaded.'''
+    if (memory := get_fuzzy_translation_memory(region_code)) is not None:
+        memory.add(text, translation)
+
+def benchmark(path: str = JSON_LANG_PATH, sample_size: int = 2000, seed: int = 1):
+    '''
+    Measures lookup latency and hit rate on the json corpus. A sample of lines is held
+    out of the index and looked up, then lines from the index are looked up again with
+    their numbers changed, which should always be reused.
+    '''
+    pairs = list(dict(iter_json_translations(path)).items())
+    rng = random.Random(seed)
+    rng.shuffle(pairs)
+    held_out, indexed = pairs[:sample_size], pairs[sample_size:]
+
+    start = time.perf_counter()
+    exact_memory = TranslationMemory()
+    fuzzy_memory = FuzzyTranslationMemory()
+    for ja, en in indexed:
+        exact_memory.add(ja, en)
+        fuzzy_memory.add(ja, en)
+    build_time = time.perf_counter() - start
+
+    variants = []
+    for ja, en in indexed:
+        numbers = re.findall(r'\d+', ja)
+        if numbers and numbers[0] in en:
+            variants.append(ja.replace(numbers[0], str(int(numbers[0]) + 1)))
+        if len(variants) == sample_size:
+            break
+
+    print(f'Indexed {len(fuzzy_memory)} lines from {len(indexed)} translations in {build_time:.2f}s')
+    for name, lines in (('Held out lines', [ja for ja, en in held_out]), ('Number variants', variants)):
+        timings = []
+        exact_hits = 0
+        fuzzy_hits = 0
+        for ja in lines:
+            start = time.perf_counter()
+            exact = exact_memory.lookup(ja)
+            fuzzy = fuzzy_memory.lookup(ja) if exact is None else None
+            timings.append(time.perf_counter() - start)
+            exact_hits += exact is not None
+            fuzzy_hits += fuzzy is not None
+        timings.sort()
+        total = max(len(lines), 1)
+        print(f'{name}: {len(lines)} lookups')
+        print(f'  exact/normalized hits: {exact_hits} ({exact_hits / total:.1%})')
+        print(f'  fuzzy hits:            {fuzzy_hits} ({fuzzy_hits / total:.1%})')
+        if timings:
+            print(f'  latency p50: {timings[len(timings) // 2] * 1000:.3f}ms  '
+                  f'p99: {timings[int(len(timings) * 0.99)] * 1000:.3f}ms  '
+                  f'max: {timings[-1] * 1000:.3f}ms')
+
+if __name__ == '__main__':
+    benchmark()